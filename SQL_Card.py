@@ -1,34 +1,823 @@
 import streamlit as st
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload
-from googleapiclient.http import MediaIoBaseDownload
-import io
+from googleapiclient.errors import HttpError
+import os
+import json
 import sqlite3
 import tempfile
-import pandas as pd
+import numpy as np
 import re
 import random
+import time
+import itertools
+import threading
+import zlib
+import unicodedata
+import atexit
+import bisect
+import csv
+import gzip
+import hashlib
+import heapq
+import io
+import contextlib
+import functools
+import math
+import urllib.parse
+import uuid
+import shutil
+import sys
 
-# Lấy thông tin credentials từ secrets
-creds_dict = dict(st.secrets["gcp_service_account"])
-credentials = service_account.Credentials.from_service_account_info(creds_dict)
-drive_service = build('drive', 'v3', credentials=credentials)
+# pandas, googleapiclient.discovery/http, google.oauth2 chỉ được import khi cần
+# để lượt chạy đầu (chưa chọn thư mục) không phải trả chi phí import chúng.
 
+if __name__ != "__main__":
+    # Được import làm thư viện (quotes_cli.py, benchmark.py, tests): gọi st.cache_resource/session_state
+    # ngoài Streamlit sẽ sinh cảnh báo "missing ScriptRunContext" vô hại. Streamlit đặt mức log riêng
+    # cho từng logger con nên phải đổi qua set_log_level, không chỉ logger "streamlit"
+    import streamlit.logger
+    streamlit.logger.set_log_level("error")
 
-def update_db_and_upload(file_id, df):
-    with tempfile.NamedTemporaryFile(suffix=".db", delete=False) as tmp:
-        conn = sqlite3.connect(tmp.name)
-        df.to_sql("quotes", conn, if_exists="replace", index=False)
+
+# === Đo thời gian các đường nóng ===
+
+PERF_LOG_PATH = os.environ.get("QUOTE_PERF_LOG")  # Ghi span dạng JSON lines nếu đặt
+PERF_HISTORY = 20
+
+
+class _NullSpan:
+    """Span không làm gì, dùng khi tắt đo để chi phí gần như bằng không"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setitem__(self, key, value):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class PerfSpan(dict):
+    """Một khoảng đo: tên, thời điểm bắt đầu so với đầu lượt chạy, thời lượng và các thuộc tính (byte, dòng...)"""
+
+    def __init__(self, run, name, attrs):
+        super().__init__(name=name, **attrs)
+        self.run = run
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self["depth"] = self.run["depth"]
+        self.run["depth"] += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        self.run["depth"] -= 1
+        self["at_ms"] = round((self.start - self.run["started"]) * 1000, 3)
+        self["ms"] = round((end - self.start) * 1000, 3)
+        if exc_type is not None:
+            self["error"] = exc_type.__name__
+        if self.run.get("spans") is not None:
+            self.run["spans"].append(dict(self))
+        else:
+            write_perf_log({"type": "span", "thread": threading.current_thread().name, **self})
+        return False
+
+
+class _PerfLocal(threading.local):
+    run = None
+
+
+@st.cache_resource(show_spinner=False)
+def perf_state():
+    # Dùng chung giữa các lần rerun: đối tượng tạo ở lượt trước (chỉ mục, hàng đợi...) vẫn
+    # ghi span vào lượt chạy hiện tại; mỗi luồng script (mỗi phiên) có lượt chạy riêng
+    return _PerfLocal()
+
+
+_perf = perf_state()
+
+
+def perf_span(name, **attrs):
+    """with perf_span("sqlite.query", rows=...) as span: ... ; span["bytes"] = n"""
+    run = _perf.run
+    if run is not None:
+        return PerfSpan(run, name, attrs)
+    if PERF_LOG_PATH:
+        # Luồng nền (hàng đợi tải lên...): không thuộc lượt chạy nào, ghi thẳng ra log
+        return PerfSpan({"started": time.perf_counter(), "depth": 0}, name, attrs)
+    return _NULL_SPAN
+
+
+def perf_timed(name):
+    """Decorator: cả lời gọi hàm là một span"""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with perf_span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def write_perf_log(record):
+    with open(PERF_LOG_PATH, "a", encoding="utf-8") as fh:
+        fh.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+
+def perf_begin_run():
+    """Bắt đầu gom span cho lượt chạy script này (chỉ khi bật panel hoặc log)"""
+    if st.session_state.get("perf_panel") or PERF_LOG_PATH:
+        _perf.run = {"started": time.perf_counter(), "ts": time.time(), "depth": 0, "spans": []}
+    else:
+        _perf.run = None
+
+
+def perf_end_run():
+    run, _perf.run = _perf.run, None
+    if run is None:
+        return None
+    record = {
+        "type": "run", "ts": run["ts"], "total_ms": round((time.perf_counter() - run["started"]) * 1000, 3),
+        "spans": run["spans"],
+    }
+    history = st.session_state.setdefault("perf_runs", [])
+    history.append(record)
+    del history[:-PERF_HISTORY]
+    if PERF_LOG_PATH:
+        write_perf_log(record)
+    return record
+
+
+def perf_panel(record):
+    """Panel Performance: các span của lượt chạy vừa rồi, gộp theo tên, và tổng thời gian các lượt gần đây"""
+    st.caption(f"Lượt chạy vừa rồi: {record['total_ms']:.1f} ms, {len(record['spans'])} span")
+    totals = {}
+    for span in record["spans"]:
+        item = totals.setdefault(span["name"], {"span": span["name"], "lần": 0, "ms": 0.0, "bytes": 0, "dòng": 0})
+        item["lần"] += 1
+        item["ms"] += span["ms"]
+        item["bytes"] += span.get("bytes", 0)
+        item["dòng"] += span.get("rows", 0)
+    st.dataframe(sorted(totals.values(), key=lambda item: -item["ms"]), hide_index=True)
+    with st.expander("Chi tiết theo thứ tự"):
+        st.dataframe([
+            {"span": "  " * span["depth"] + span["name"], "bắt đầu (ms)": span["at_ms"], "ms": span["ms"],
+             **{k: v for k, v in span.items() if k not in ("name", "depth", "at_ms", "ms")}}
+            for span in record["spans"]
+        ], hide_index=True)
+    st.line_chart([run["total_ms"] for run in st.session_state.get("perf_runs", [])], height=120)
+
+
+# === Client Drive dùng chung ===
+
+DRIVE_BATCH_SIZE = 100  # Giới hạn số request trong một batch của Drive API
+
+
+class DrivePool:
+    """Các client Drive dùng chung cho cả tiến trình.
+
+    Credentials (và access token) được tạo một lần. Mỗi client chỉ được một luồng dùng
+    tại một thời điểm (http của googleapiclient không an toàn đa luồng), trả lại pool
+    sau khi dùng để lần sau dùng lại kết nối keep-alive của nó."""
+
+    def __init__(self, creds_info):
+        from google.oauth2 import service_account
+        self.credentials = service_account.Credentials.from_service_account_info(creds_info)
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _build(self):
+        from googleapiclient.discovery import build
+        return build('drive', 'v3', credentials=self.credentials, cache_discovery=False)
+
+    @contextlib.contextmanager
+    def client(self):
+        with self._lock:
+            service = self._idle.pop() if self._idle else None
+        if service is None:
+            service = self._build()
+        try:
+            yield service
+        finally:
+            with self._lock:
+                self._idle.append(service)
+
+
+@st.cache_resource(show_spinner=False)
+def get_drive_pool():
+    # Lấy thông tin credentials từ secrets
+    return DrivePool(dict(st.secrets["gcp_service_account"]))
+
+
+def drive_client():
+    return get_drive_pool().client()
+
+
+def batch_execute(service, requests):
+    """Gửi nhiều request qua Drive batch (tối đa DRIVE_BATCH_SIZE mỗi lượt).
+
+    Trả về danh sách (kết quả, lỗi) theo đúng thứ tự requests."""
+    results = [None] * len(requests)
+    for start in range(0, len(requests), DRIVE_BATCH_SIZE):
+        def callback(request_id, response, exception):
+            results[int(request_id)] = (response, exception)
+        batch = service.new_batch_http_request(callback=callback)
+        chunk = requests[start:start + DRIVE_BATCH_SIZE]
+        for i, request in enumerate(chunk, start):
+            batch.add(request, request_id=str(i))
+        with perf_span("drive.batch", requests=len(chunk)):
+            batch.execute()
+    return results
+
+
+QUOTE_COLUMNS = ["id", "content", "speaker", "note", "date", "tag", "link"]
+QUOTES_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS quotes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        content TEXT,
+        speaker TEXT,
+        note TEXT,
+        date TEXT,
+        tag TEXT,
+        link TEXT
+    )
+'''
+
+
+# Bảng FTS5 lưu bản đã bỏ dấu (kể cả đ -> d) của content/tag, rowid = quotes.id
+def _fold_sql(col):
+    return f"replace(replace({col}, 'đ', 'd'), 'Đ', 'D')"
+
+
+QUOTES_FTS_SCHEMA = [
+    '''
+    CREATE VIRTUAL TABLE quotes_fts USING fts5(
+        content, tag,
+        content='quotes', content_rowid='id',
+        tokenize="unicode61 remove_diacritics 2"
+    )
+    ''',
+    f'''
+    CREATE TRIGGER quotes_fts_ai AFTER INSERT ON quotes BEGIN
+        INSERT INTO quotes_fts(rowid, content, tag)
+        VALUES (new.id, {_fold_sql("new.content")}, {_fold_sql("new.tag")});
+    END
+    ''',
+    f'''
+    CREATE TRIGGER quotes_fts_ad AFTER DELETE ON quotes BEGIN
+        INSERT INTO quotes_fts(quotes_fts, rowid, content, tag)
+        VALUES ('delete', old.id, {_fold_sql("old.content")}, {_fold_sql("old.tag")});
+    END
+    ''',
+    f'''
+    CREATE TRIGGER quotes_fts_au AFTER UPDATE ON quotes BEGIN
+        INSERT INTO quotes_fts(quotes_fts, rowid, content, tag)
+        VALUES ('delete', old.id, {_fold_sql("old.content")}, {_fold_sql("old.tag")});
+        INSERT INTO quotes_fts(rowid, content, tag)
+        VALUES (new.id, {_fold_sql("new.content")}, {_fold_sql("new.tag")});
+    END
+    ''',
+]
+SEARCH_LIMIT = 200
+
+
+def ensure_quotes_schema(conn):
+    """Đảm bảo bảng quotes có id là PRIMARY KEY, đủ các cột QUOTE_COLUMNS và có chỉ mục tìm kiếm FTS5"""
+    info = conn.execute("PRAGMA table_info(quotes)").fetchall()
+    existing = {col[1] for col in info}
+    if not info:
+        conn.execute(QUOTES_SCHEMA)
+        conn.commit()
+    elif not any(col[1] == "id" and col[5] for col in info):
+        # File cũ ghi bằng to_sql không có PRIMARY KEY
+        _rebuild_quotes_table(conn, existing)
+    elif any(c not in existing for c in QUOTE_COLUMNS):
+        # File tạo trước khi có cột mới (vd. link): thêm cột rỗng
+        with conn:
+            for col in QUOTE_COLUMNS[1:]:
+                if col not in existing:
+                    conn.execute(f"ALTER TABLE quotes ADD COLUMN {col} TEXT")
+    ensure_quotes_fts(conn)
+
+
+def ensure_quotes_fts(conn):
+    names = {row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE name IN ('quotes_fts', 'quotes_fts_ai', 'quotes_fts_ad', 'quotes_fts_au')"
+    )}
+    if len(names) == 4:
+        return
+    try:
+        with conn:
+            conn.execute("DROP TABLE IF EXISTS quotes_fts")
+            for trigger in ("quotes_fts_ai", "quotes_fts_ad", "quotes_fts_au"):
+                conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            for statement in QUOTES_FTS_SCHEMA:
+                conn.execute(statement)
+            conn.execute(
+                f"INSERT INTO quotes_fts(rowid, content, tag) "
+                f"SELECT id, {_fold_sql('content')}, {_fold_sql('tag')} FROM quotes"
+            )
+    except sqlite3.OperationalError as e:
+        # SQLite không có FTS5 thì vẫn tìm kiếm bằng pandas như cũ
+        print(f"Không tạo được chỉ mục FTS5: {e}")
+
+
+def _rebuild_quotes_table(conn, existing):
+    """Dựng lại bảng: giữ id đầu tiên, các id trùng hoặc rỗng được cấp id mới"""
+    data_cols = [c for c in QUOTE_COLUMNS[1:] if c in existing]
+    col_list = ", ".join(data_cols)
+    ranked = (
+        f"SELECT CAST(id AS INTEGER) AS id, {col_list}, rowid AS rid, "
+        f"ROW_NUMBER() OVER (PARTITION BY CAST(id AS INTEGER) ORDER BY rowid) AS rn FROM quotes"
+    )
+    with conn:
+        conn.execute("DROP TABLE IF EXISTS quotes_new")
+        conn.execute(QUOTES_SCHEMA.replace("quotes", "quotes_new", 1))
+        conn.execute(
+            f"INSERT INTO quotes_new (id, {col_list}) SELECT id, {col_list} FROM ({ranked}) "
+            f"WHERE id IS NOT NULL AND rn = 1 ORDER BY rid"
+        )
+        conn.execute(
+            f"INSERT INTO quotes_new ({col_list}) SELECT {col_list} FROM ({ranked}) "
+            f"WHERE id IS NULL OR rn > 1 ORDER BY rid"
+        )
+        conn.execute("DROP TABLE quotes")
+        conn.execute("ALTER TABLE quotes_new RENAME TO quotes")
+
+
+def _sql_value(value):
+    # sqlite3 không nhận kiểu numpy / NaN của pandas
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return value.item() if hasattr(value, "item") else value
+
+
+def _quote_params(row):
+    return [_sql_value(row.get(col)) for col in QUOTE_COLUMNS[1:]]
+
+
+def new_change_set():
+    return {"insert": {}, "update": {}, "delete": set()}
+
+
+def record_change(kind, quote_id, row=None):
+    """Ghi lại thay đổi của một dòng kể từ lần đồng bộ gần nhất"""
+    changes = st.session_state.setdefault("pending_changes", new_change_set())
+    quote_id = int(quote_id)
+    if kind == "insert":
+        changes["insert"][quote_id] = dict(row)
+    elif kind == "update":
+        if quote_id in changes["insert"]:
+            changes["insert"][quote_id] = dict(row)
+        else:
+            changes["update"][quote_id] = dict(row)
+    elif kind == "delete":
+        if changes["insert"].pop(quote_id, None) is None:
+            changes["update"].pop(quote_id, None)
+            changes["delete"].add(quote_id)
+    else:
+        raise ValueError(f"Loại thay đổi không hợp lệ: {kind}")
+
+
+def temp_quote_id():
+    """id tạm (âm, theo phiên) cho quote mới chưa ghi vào file; không bao giờ trùng id thật,
+    kể cả id vừa bị xoá mà chỉ mục tag còn giữ dấu xoá"""
+    st.session_state["temp_quote_id"] = st.session_state.get("temp_quote_id", 0) - 1
+    return st.session_state["temp_quote_id"]
+
+
+def count_changes(changes):
+    return len(changes["insert"]) + len(changes["update"]) + len(changes["delete"])
+
+
+def db_uri(db_path, mode="rw"):
+    return f"file:{urllib.parse.quote(os.path.abspath(db_path))}?mode={mode}"
+
+
+def connect_existing(db_path):
+    """Mở một file SQLite đã có; file không tồn tại (vd. đã bị xoá khỏi cache) thì báo lỗi
+    thay vì để sqlite3.connect lặng lẽ tạo một DB rỗng"""
+    return sqlite3.connect(db_uri(db_path), uri=True)
+
+
+@perf_timed("sqlite.apply_changes")
+def apply_changes(db_path, changes):
+    """Áp các dòng thêm/sửa/xoá vào bản sao SQLite cục bộ.
+
+    Dòng thêm mới được ghi không kèm id để AUTOINCREMENT cấp id thật (file có thể dùng chung với
+    phiên khác nên không tự chọn id). File dùng chung cũng có thể đã mất dòng đang sửa (phiên khác
+    xoá hoặc chuyển đi), các dòng đó không được ghi.
+
+    Trả về (số dòng thật sự đã ghi, {id tạm: id thật}, tập id sửa không còn trong file)."""
+    if not changes or not count_changes(changes):
+        return 0, {}, set()
+    new_ids, missing = {}, set()
+    conn = connect_existing(db_path)
+    try:
+        with conn:
+            applied = conn.executemany(
+                "DELETE FROM quotes WHERE id = ?",
+                [(i,) for i in changes["delete"]]
+            ).rowcount
+            for quote_id, row in changes["update"].items():
+                cur = conn.execute(
+                    "UPDATE quotes SET content = ?, speaker = ?, note = ?, date = ?, tag = ?, link = ? WHERE id = ?",
+                    _quote_params(row) + [quote_id]
+                )
+                if cur.rowcount:
+                    applied += 1
+                else:
+                    missing.add(quote_id)
+            for temp_id in sorted(changes["insert"]):
+                cur = conn.execute(
+                    "INSERT INTO quotes (content, speaker, note, date, tag, link) VALUES (?, ?, ?, ?, ?, ?)",
+                    _quote_params(changes["insert"][temp_id])
+                )
+                new_ids[temp_id] = cur.lastrowid
+                applied += 1
+    finally:
         conn.close()
+    return applied, new_ids, missing
+
+
+@perf_timed("sqlite.write_full_db")
+def write_full_db(db_path, df):
+    """Ghi lại toàn bộ bảng quotes (chỉ dùng khi id thay đổi hàng loạt)"""
+    conn = connect_existing(db_path)
+    try:
+        with conn:
+            conn.execute("DELETE FROM quotes")
+            conn.executemany(
+                "INSERT INTO quotes (id, content, speaker, note, date, tag, link) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [[_sql_value(row["id"])] + _quote_params(row) for row in df.to_dict("records")]
+            )
+    finally:
+        conn.close()
+
+
+# === Truyền file với Drive ===
+
+# Upload resumable yêu cầu chunk là bội số của 256 KB
+TRANSFER_CHUNK_BYTES = max(1, int(os.environ.get("QUOTE_TRANSFER_CHUNK_MB", "8"))) * 1024 * 1024
+TRANSFER_MAX_RETRIES = int(os.environ.get("QUOTE_TRANSFER_MAX_RETRIES", "5"))
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+def is_retryable_error(exc):
+    import httplib2
+    if isinstance(exc, HttpError):
+        return exc.resp.status in RETRYABLE_STATUS
+    return isinstance(exc, (OSError, httplib2.HttpLib2Error))
+
+
+def run_chunked(next_chunk, progress=None):
+    """Gọi next_chunk() tới khi xong; lỗi mạng tạm thời thì chờ (backoff) rồi chạy tiếp từ chunk đang dở"""
+    attempt = 0
+    while True:
+        try:
+            status, result = next_chunk()
+        except Exception as e:
+            if attempt >= TRANSFER_MAX_RETRIES or not is_retryable_error(e):
+                raise
+            time.sleep(min(2 ** attempt, 32) + random.random())
+            attempt += 1
+            continue
+        attempt = 0
+        if progress and status is not None:
+            progress(status.resumable_progress, status.total_size)
+        if result:
+            return result
+
+
+# File DB trên Drive là SQLite thô ("plain") hoặc SQLite nén gzip ("gzip"), chọn riêng cho
+# từng file và ghi ở appProperties.dbEncoding. Khi tải về, định dạng được nhận theo magic bytes;
+# khi lưu, file giữ encoding đã ghi của nó. File chưa ghi encoding (vd. do bản app cũ tạo)
+# dùng DB_TRANSFER_ENCODING, mặc định "plain" để công cụ SQLite khác vẫn mở được.
+DB_TRANSFER_ENCODING = os.environ.get("QUOTE_DB_TRANSFER_ENCODING", "plain")
+# Mức 1: nén ~2.5x mà tốn ít CPU, nên vẫn nhanh hơn tải file thô cả khi mạng nhanh
+DB_GZIP_LEVEL = int(os.environ.get("QUOTE_DB_GZIP_LEVEL", "1"))
+GZIP_MAGIC = b"\x1f\x8b"
+INFLATE_PIECE_BYTES = 1024 * 1024
+
+
+class DecodingWriter:
+    """File đích của một lần tải: nhận ra gzip qua 2 byte đầu và giải nén ngay khi ghi từng chunk"""
+
+    def __init__(self, fh):
+        self.fh = fh
+        self.encoding = None
+        self.received = 0
+        self._head = b""
+        self._inflater = None
+
+    def write(self, data):
+        size = len(data)
+        self.received += size
+        if self.encoding is None:
+            self._head += data
+            if len(self._head) < len(GZIP_MAGIC):
+                return size
+            data, self._head = self._head, b""
+            self.encoding = "gzip" if data.startswith(GZIP_MAGIC) else "plain"
+            if self.encoding == "gzip":
+                self._inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if self._inflater is None:
+            self.fh.write(data)
+        else:
+            # Giải nén từng phần để một chunk nén tốt không bung ra quá nhiều RAM
+            while data:
+                self.fh.write(self._inflater.decompress(data, INFLATE_PIECE_BYTES))
+                data = self._inflater.unconsumed_tail
+        return size
+
+    def finish(self):
+        if self.encoding is None:
+            self.fh.write(self._head)
+            self.encoding = "plain"
+        elif self._inflater is not None:
+            self.fh.write(self._inflater.flush())
+            if not self._inflater.eof:
+                raise ValueError("File database nén tải về không đầy đủ")
+
+
+def download_db_file(file_id, fh, progress=None):
+    """Tải file thẳng vào fh theo từng chunk (giải nén nếu file được lưu dạng gzip), không giữ cả file trong RAM"""
+    from googleapiclient.http import MediaIoBaseDownload
+    with perf_span("drive.download", file_id=file_id) as span, drive_client() as service:
+        writer = DecodingWriter(fh)
+        request = service.files().get_media(fileId=file_id)
+        downloader = MediaIoBaseDownload(writer, request, chunksize=TRANSFER_CHUNK_BYTES)
+        run_chunked(downloader.next_chunk, progress)
+        writer.finish()
+        span["bytes"] = writer.received
+        span["encoding"] = writer.encoding
+    return fh
+
+
+def encode_db_file(path, encoding):
+    """Trả về (file để tải lên, encoding); với gzip là một file .gz tạm, người gọi tự xoá"""
+    if encoding != "gzip":
+        return path, "plain"
+    gz_path = path + ".gz"
+    with perf_span("gzip.compress", bytes=os.path.getsize(path)), open(path, "rb") as src, \
+            gzip.GzipFile(gz_path, "wb", compresslevel=DB_GZIP_LEVEL, mtime=0) as dst:
+        shutil.copyfileobj(src, dst, TRANSFER_CHUNK_BYTES)
+    return gz_path, "gzip"
+
+
+def upload_db_file(path, file_id, fields="id, name", progress=None, encoding=None):
+    """Ghi đè nội dung file_id trên Drive bằng file DB ở path.
+
+    encoding mặc định là encoding đã ghi của file (xem cached_encoding)."""
+    upload_path, encoding = encode_db_file(path, encoding or cached_encoding(file_id))
+    try:
+        return upload_file(
+            upload_path, file_id=file_id, metadata={"appProperties": {"dbEncoding": encoding}},
+            fields=fields, progress=progress,
+            mimetype="application/gzip" if encoding == "gzip" else "application/x-sqlite3"
+        )
+    finally:
+        if upload_path != path:
+            os.remove(upload_path)
+
+
+def upload_file(path, file_id=None, metadata=None, fields="id, name", progress=None,
+                mimetype='application/x-sqlite3'):
+    """Upload resumable: cập nhật file_id nếu có, nếu không thì tạo file mới từ metadata"""
+    from googleapiclient.http import MediaFileUpload
+    media = MediaFileUpload(path, mimetype=mimetype, chunksize=TRANSFER_CHUNK_BYTES, resumable=True)
+    with perf_span("drive.upload", file_id=file_id, bytes=media.size()), drive_client() as service:
+        if file_id:
+            request = service.files().update(fileId=file_id, body=metadata, media_body=media, fields=fields)
+        else:
+            request = service.files().create(body=metadata, media_body=media, fields=fields)
+        result = run_chunked(request.next_chunk, progress)
+    if progress:
+        progress(media.size(), media.size())
+    return result
+
+
+def progress_bar(label, container=None):
+    """Trả về callback (đã truyền, tổng số byte) vẽ thanh tiến trình khi có dữ liệu đầu tiên"""
+    bar = None
+
+    def update(done, total):
+        nonlocal bar
+        if not total:
+            return
+        if bar is None:
+            bar = (container or st.sidebar).progress(0.0, text=label)
+        bar.progress(min(done / total, 1.0), text=f"{label} {done / 1048576:.1f}/{total / 1048576:.1f} MB")
+    return update
+
+
+# === Cache file DB trên đĩa ===
+
+CACHE_DIR = os.environ.get("QUOTE_DB_CACHE_DIR", os.path.join(tempfile.gettempdir(), "quote_db_cache"))
+CACHE_MAX_BYTES = int(os.environ.get("QUOTE_DB_CACHE_MAX_MB", "512")) * 1024 * 1024
+REMOTE_META_FIELDS = "id, name, md5Checksum, modifiedTime, size, appProperties"
+
+
+SESSION_PIN_TTL_SECONDS = int(os.environ.get("QUOTE_SESSION_PIN_TTL", str(6 * 3600)))
+
+
+class CachePins:
+    """Các file cache đang có người dùng, evict_cache không được xoá.
+
+    Hai loại: DB đang mở của mỗi phiên (làm mới mỗi lượt chạy, hết hạn sau
+    SESSION_PIN_TTL_SECONDS vì Streamlit không báo khi phiên đóng), và các lần dùng
+    ngắn trong code (luồng tìm kiếm, file đích khi chép...) qua `with pins.hold(file_id)`."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.holds = {}  # file_id -> số lần đang giữ
+        self.sessions = {}  # khoá phiên -> (file_id, lúc thấy lần cuối)
+
+    @contextlib.contextmanager
+    def hold(self, file_id):
+        with self.lock:
+            self.holds[file_id] = self.holds.get(file_id, 0) + 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.holds[file_id] -= 1
+                if not self.holds[file_id]:
+                    del self.holds[file_id]
+
+    def pin_session(self, session_key, file_id):
+        with self.lock:
+            self.sessions[session_key] = (file_id, time.monotonic())
+
+    def pinned(self):
+        cutoff = time.monotonic() - SESSION_PIN_TTL_SECONDS
+        with self.lock:
+            for key, (_, seen) in list(self.sessions.items()):
+                if seen < cutoff:
+                    del self.sessions[key]
+            return set(self.holds) | {file_id for file_id, _ in self.sessions.values()}
+
+
+@st.cache_resource
+def get_cache_pins():
+    return CachePins()
+
+
+def pin_session_db(file_id):
+    """Giữ DB đang mở của phiên này khỏi bị evict_cache xoá"""
+    key = st.session_state.setdefault("cache_pin_key", uuid.uuid4().hex)
+    get_cache_pins().pin_session(key, file_id)
+
+
+def cache_paths(file_id):
+    base = os.path.join(CACHE_DIR, file_id)
+    return base + ".db", base + ".json"
+
+
+def read_cache_meta(file_id):
+    _, meta_path = cache_paths(file_id)
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_cache_meta(file_id, remote_meta, dirty=False):
+    _, meta_path = cache_paths(file_id)
+    meta = {
+        "md5Checksum": remote_meta.get("md5Checksum"),
+        "modifiedTime": remote_meta.get("modifiedTime"),
+        "size": remote_meta.get("size"),
+        # Meta từ Drive có appProperties; meta đọc lại từ cache thì đã có sẵn "encoding"
+        "encoding": (remote_meta.get("appProperties") or {}).get("dbEncoding") or remote_meta.get("encoding"),
+        "dirty": dirty,
+    }
+    # Tên tạm riêng cho mỗi lần ghi: luồng tải lên và luồng script có thể ghi cùng lúc
+    fd, tmp_path = tempfile.mkstemp(suffix=".json.tmp", dir=CACHE_DIR)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def cached_encoding(file_id):
+    """Encoding để lưu file lên Drive: theo appProperties đã thấy lần tải/lưu trước"""
+    return (read_cache_meta(file_id) or {}).get("encoding") or DB_TRANSFER_ENCODING
+
+
+def set_db_encoding(file_id, encoding):
+    """Đổi encoding lưu của một file; có hiệu lực ở lần tải lên kế tiếp"""
+    meta = read_cache_meta(file_id) or {}
+    write_cache_meta(file_id, {**meta, "encoding": encoding}, dirty=True)
+
+
+def mark_cache_dirty(file_id):
+    """Đánh dấu bản cache có thay đổi chưa tải lên, để không bị ghi đè hay bị xoá"""
+    meta = read_cache_meta(file_id) or {}
+    write_cache_meta(file_id, meta, dirty=True)
+
+
+def is_cache_fresh(cached, remote):
+    if not cached:
+        return False
+    if cached.get("dirty"):
+        return True
+    if remote.get("md5Checksum"):
+        return cached.get("md5Checksum") == remote["md5Checksum"]
+    return (cached.get("modifiedTime"), cached.get("size")) == (remote.get("modifiedTime"), remote.get("size"))
+
+
+def drop_cache_entry(file_id):
+    db_path, meta_path = cache_paths(file_id)
+    for path in (db_path, meta_path, near_dup_path(db_path)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    # Nhả cả QuoteStore dùng chung và chỉ mục gần trùng đang giữ trong RAM của file này
+    registry = quote_store_registry()
+    with registry["lock"]:
+        registry["stores"].pop(db_path, None)
+    get_near_dup_index.clear(db_path)
+
+
+def evict_cache(keep=None):
+    """Xoá các file ít dùng nhất cho tới khi cache nằm trong giới hạn dung lượng.
+
+    Chỉ xét các file .db có file meta .json đi kèm (file đang tải về, bản chụp... không phải mục cache).
+    Bỏ qua file keep, các file đang được ghim (CachePins) và file còn thay đổi chưa tải lên."""
+    pinned = get_cache_pins().pinned()
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        if not name.endswith(".db") or not os.path.exists(cache_paths(name[:-3])[1]):
+            continue
+        path = os.path.join(CACHE_DIR, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        # File chữ ký gần trùng (.minhash.npz) đi kèm cũng tính vào dung lượng của mục cache
+        try:
+            sidecar = os.path.getsize(near_dup_path(path))
+        except OSError:
+            sidecar = 0
+        entries.append((max(stat.st_atime, stat.st_mtime), stat.st_size + sidecar, name[:-3]))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, file_id in sorted(entries):
+        if total <= CACHE_MAX_BYTES:
+            break
+        if file_id == keep or file_id in pinned or (read_cache_meta(file_id) or {}).get("dirty"):
+            continue
+        drop_cache_entry(file_id)
+        total -= size
+
+
+@perf_timed("fetch_db_file")
+def fetch_db_file(file_id, progress=None):
+    """Trả về đường dẫn file DB trong cache, chỉ tải lại khi bản trên Drive đã đổi"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    db_path, _ = cache_paths(file_id)
+    with perf_span("drive.get", file_id=file_id), drive_client() as service:
+        remote = service.files().get(fileId=file_id, fields=REMOTE_META_FIELDS).execute()
+    # Bản cục bộ còn chờ tải lên thì mới hơn bản trên Drive
+    if os.path.exists(db_path) and (
+        is_cache_fresh(read_cache_meta(file_id), remote) or get_upload_queue().has_pending(file_id)
+    ):
+        # Chỉ đánh dấu lần dùng qua atime; mtime là phiên bản nội dung (QuoteStore, chỉ mục gần trùng)
+        os.utime(db_path, ns=(time.time_ns(), os.stat(db_path).st_mtime_ns))
+        return db_path
+
+    with tempfile.NamedTemporaryFile(dir=CACHE_DIR, suffix=".part", delete=False) as tmp:
+        try:
+            download_db_file(file_id, tmp, progress)
+        except Exception:
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+    try:
+        with perf_span("sqlite.ensure_schema"):
+            conn = sqlite3.connect(tmp.name)
+            try:
+                ensure_quotes_schema(conn)
+            finally:
+                conn.close()
+        os.replace(tmp.name, db_path)
+    except Exception:
+        os.remove(tmp.name)
+        raise
+    write_cache_meta(file_id, remote)
+    evict_cache(keep=file_id)
+    return db_path
 
-        tmp.seek(0)
-        media = MediaIoBaseUpload(open(tmp.name, "rb"), mimetype='application/x-sqlite3')
-        updated_file = drive_service.files().update(
-            fileId=file_id,
-            media_body=media
-        ).execute()
-    return updated_file
 
 def extract_folder_id(url):
     if "folders/" in url:
@@ -38,12 +827,14 @@ def extract_folder_id(url):
     else:
         return None
 def quote_edit_form(selected_row):
-    df = st.session_state.get("quotes_df", pd.DataFrame())
+    db_path = st.session_state.get("local_db_path")
 
-    speaker_suggestions = sorted(df["speaker"].dropna().unique()) if not df.empty else []
-    tag_suggestions = sorted(df["tag"].dropna().unique()) if not df.empty else []
+    tag_index = get_tag_index(db_path) if db_path else None
+    speaker_suggestions = tag_index.vocabulary("speaker").suggest() if tag_index else []
+    if selected_row["speaker"] and selected_row["speaker"] not in speaker_suggestions:
+        speaker_suggestions.append(selected_row["speaker"])
 
-    content = st.text_area("📝 Nội dung", selected_row["content"])
+    content = st.text_area("📝 Nội dung", selected_row["content"] or "")
 
     col1, col2 = st.columns(2)
     with col1:
@@ -53,14 +844,15 @@ def quote_edit_form(selected_row):
             speaker_suggestions.index(selected_row["speaker"]) + 1 if selected_row["speaker"] in speaker_suggestions else 0
         ))
 
-    note = st.text_input("📌 Ghi chú", selected_row["note"])
-    date = st.text_input("📅 Ngày", selected_row["date"])
-    link = st.text_input("🔗 Link", selected_row["link"])
+    note = st.text_input("📌 Ghi chú", selected_row["note"] or "")
+    date = st.text_input("📅 Ngày", selected_row["date"] or "")
+    link = st.text_input("🔗 Link", selected_row["link"] or "")
 
-    current_tags = selected_row["tag"].split()
+    current_tags = list(dict.fromkeys(split_tags(selected_row["tag"])))
 
-    all_tags = sorted(df["tag"].dropna().str.split().sum()) if not df.empty else []
-    all_tags = sorted(set(all_tags))
+    # Tag đang gắn luôn có trong options dù không nằm trong nhóm gợi ý
+    tag_suggestions = tag_index.vocabulary("tag").suggest() if tag_index else []
+    all_tags = list(dict.fromkeys(tag_suggestions + current_tags))
 
     tags_selected = st.multiselect("🏷️ Chọn hoặc nhập nhiều tag", options=all_tags, default=current_tags)
     manual_tag_input = st.text_input("🏷️ Nhập thêm tag mới (cách nhau bởi dấu cách)", value="")
@@ -87,10 +879,12 @@ def truncate_at_special_chars(filename, extension=".db"):
     return filename + extension
 
 def quote_input_form():
-    df = st.session_state.get("quotes_df", pd.DataFrame())
+    db_path = st.session_state.get("local_db_path")
 
-    speaker_suggestions = sorted(df["speaker"].dropna().unique()) if not df.empty else []
-    tag_suggestions = sorted(df["tag"].dropna().unique()) if not df.empty else []
+    # Gợi ý lấy từ Vocabulary của chỉ mục tag: dùng nhiều nhất lên đầu, tối đa VOCAB_SUGGEST_LIMIT
+    tag_index = get_tag_index(db_path) if db_path else None
+    speaker_suggestions = tag_index.vocabulary("speaker").suggest() if tag_index else []
+    tag_suggestions = tag_index.vocabulary("tag").suggest() if tag_index else []
 
     content = st.text_area("📜 Nội dung", height=150)
 
@@ -124,109 +918,1531 @@ def quote_input_form():
     return content, speaker, note, date, tag, link
 
 
-def delete_db_file(folder_id, filename):
-    """Xoá file theo tên trong thư mục cụ thể"""
+# === Danh sách file DB trong thư mục Drive ===
+
+FOLDER_LIST_TTL_SECONDS = float(os.environ.get("QUOTE_FOLDER_LIST_TTL_SECONDS", "600"))
+FOLDER_POLL_SECONDS = float(os.environ.get("QUOTE_FOLDER_POLL_SECONDS", "15"))
+FOLDER_PAGE_SIZE = 1000
+CHANGE_FIELDS = "nextPageToken, newStartPageToken, changes(fileId, removed, file(id, name, parents, trashed))"
+
+
+class FolderListing:
+    """Danh sách file .db của một thư mục, giữ giữa các lần rerun.
+
+    Liệt kê đủ mọi trang khi hết hạn TTL, giữa hai lần liệt kê chỉ đọc các thay đổi
+    mới từ changes feed của Drive (không quá một lần mỗi FOLDER_POLL_SECONDS)."""
+
+    def __init__(self, folder_id):
+        self.folder_id = folder_id
+        self._files = {}
+        self._change_token = None
+        self.listed_at = None
+        self.polled_at = None
+        self._lock = threading.Lock()
+
+    def files(self, force=False):
+        with self._lock:
+            now = time.time()
+            relist = force or self.listed_at is None or now - self.listed_at > FOLDER_LIST_TTL_SECONDS
+            if relist or now - self.polled_at > FOLDER_POLL_SECONDS:
+                with drive_client() as service:
+                    if relist:
+                        self._relist(service)
+                    else:
+                        try:
+                            self._poll_changes(service)
+                        except HttpError:
+                            # Token hết hạn hoặc không được đọc changes feed thì liệt kê lại
+                            self._relist(service)
+            return sorted(self._files.values(), key=lambda f: f["name"])
+
+    def _relist(self, service):
+        # Lấy token trước khi liệt kê để không bỏ sót thay đổi xảy ra trong lúc liệt kê
+        with perf_span("drive.start_page_token"):
+            token = service.changes().getStartPageToken().execute()["startPageToken"]
+        files, page_token = {}, None
+        while True:
+            with perf_span("drive.list") as span:
+                results = service.files().list(
+                    q=f"'{self.folder_id}' in parents and name contains '.db' and trashed = false",
+                    fields="nextPageToken, files(id, name)",
+                    pageSize=FOLDER_PAGE_SIZE,
+                    pageToken=page_token
+                ).execute()
+                span["rows"] = len(results.get("files", []))
+            for f in results.get("files", []):
+                files[f["id"]] = {"id": f["id"], "name": f["name"]}
+            page_token = results.get("nextPageToken")
+            if not page_token:
+                break
+        self._files = files
+        self._change_token = token
+        self.listed_at = self.polled_at = time.time()
+
+    def _poll_changes(self, service):
+        token = self._change_token
+        while True:
+            with perf_span("drive.changes") as span:
+                results = service.changes().list(
+                    pageToken=token, fields=CHANGE_FIELDS, pageSize=FOLDER_PAGE_SIZE, spaces="drive"
+                ).execute()
+                span["rows"] = len(results.get("changes", []))
+            for change in results.get("changes", []):
+                self._apply_change(change)
+            if "newStartPageToken" in results:
+                self._change_token = results["newStartPageToken"]
+                break
+            token = results["nextPageToken"]
+        self.polled_at = time.time()
+
+    def _apply_change(self, change):
+        f = change.get("file")
+        if (
+            change.get("removed") or not f or f.get("trashed")
+            or self.folder_id not in f.get("parents", []) or ".db" not in f.get("name", "")
+        ):
+            self._files.pop(change["fileId"], None)
+        else:
+            self._files[f["id"]] = {"id": f["id"], "name": f["name"]}
+
+    def find(self, name):
+        with self._lock:
+            return next((f for f in self._files.values() if f["name"] == name), None)
+
+    def add(self, file):
+        with self._lock:
+            self._files[file["id"]] = {"id": file["id"], "name": file["name"]}
+
+    def remove(self, file_id):
+        with self._lock:
+            self._files.pop(file_id, None)
+
+
+@st.cache_resource(show_spinner=False)
+def get_folder_listing(folder_id):
+    return FolderListing(folder_id)
+
+
+def delete_db_files(folder_id, filenames):
+    """Xoá các file theo tên trong thư mục cụ thể bằng một batch request.
+
+    Trả về (tên đã xoá, tên không tìm thấy hoặc không xoá được)."""
+    listing = get_folder_listing(folder_id)
+    found = {name: listing.find(name) for name in filenames}
+    if not all(found.values()):
+        listing.files(force=True)
+        found = {name: listing.find(name) for name in filenames}
+    targets = [(name, file) for name, file in found.items() if file]
+    deleted, failed = [], [name for name, file in found.items() if file is None]
+    if not targets:
+        return deleted, failed
     try:
-        results = drive_service.files().list(
-            q=f"'{folder_id}' in parents and name = '{filename}'",
-            fields="files(id, name)",
-            pageSize=1
-        ).execute()
-        files = results.get("files", [])
-        if files:
-            file_id = files[0]["id"]
-            drive_service.files().delete(fileId=file_id).execute()
-            return True
-        return False
+        with drive_client() as service:
+            results = batch_execute(service, [service.files().delete(fileId=file["id"]) for _, file in targets])
     except Exception as e:
         print(f"Lỗi xoá file: {e}")
-        return False
-
-def create_empty_db_file(folder_id, filename):
+        return deleted, failed + [name for name, _ in targets]
+    for (name, file), (_, error) in zip(targets, results):
+        if error is not None:
+            print(f"Lỗi xoá file {name}: {error}")
+            failed.append(name)
+            continue
+        listing.remove(file["id"])
+        drop_cache_entry(file["id"])
+        deleted.append(name)
+    return deleted, failed
+
+def create_empty_db_files(folder_id, filenames):
+    """Tạo các file database rỗng: tải lên một file mẫu, các file còn lại được
+    sao chép từ nó trên Drive trong một batch request.
+
+    Trả về (các file đã tạo, tên không tạo được)."""
     with tempfile.NamedTemporaryFile(suffix=".db", delete=False) as tmp:
         conn = sqlite3.connect(tmp.name)
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS quotes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                content TEXT,
-                speaker TEXT,
-                note TEXT,
-                date TEXT,
-                tag TEXT,
-                link TEXT
-            )
-        ''')
-        conn.commit()
+        ensure_quotes_schema(conn)
         conn.close()
-        tmp.seek(0)
-        media = MediaIoBaseUpload(tmp, mimetype='application/octet-stream')
+    try:
         file_metadata = {
-            'name': filename,
+            'name': filenames[0],
             'parents': [folder_id],
             'mimeType': 'application/x-sqlite3'
         }
-        file = drive_service.files().create(
-            body=file_metadata,
-            media_body=media,
-            fields='id, name'
-        ).execute()
-        return file
-
-
-def download_db_file(file_id):
-    request = drive_service.files().get_media(fileId=file_id)
-    fh = io.BytesIO()
-    downloader = MediaIoBaseDownload(fh, request)
-    done = False
-    while not done:
-        status, done = downloader.next_chunk()
-    fh.seek(0)
-    return fh
+        first = upload_file(tmp.name, metadata=file_metadata, mimetype='application/octet-stream')
+    finally:
+        os.remove(tmp.name)
+    created, failed = [first], []
+    if len(filenames) > 1:
+        with drive_client() as service:
+            results = batch_execute(service, [
+                service.files().copy(fileId=first["id"], body={'name': name, 'parents': [folder_id]}, fields="id, name")
+                for name in filenames[1:]
+            ])
+        for name, (file, error) in zip(filenames[1:], results):
+            if error is not None:
+                print(f"Lỗi tạo file {name}: {error}")
+                failed.append(name)
+            else:
+                created.append(file)
+    listing = get_folder_listing(folder_id)
+    for file in created:
+        listing.add(file)
+    return created, failed
 
-def load_quotes_from_drive(file_id):
-    content = download_db_file(file_id)
-    with tempfile.NamedTemporaryFile(suffix=".db", delete=False) as tmp:
-        tmp.write(content.read())
-        tmp.flush()
-        conn = sqlite3.connect(tmp.name)
-        df = pd.read_sql_query("SELECT * FROM quotes", conn)
+
+@perf_timed("pandas.read_sql_query")
+def read_quotes(db_path):
+    import pandas as pd
+    conn = connect_existing(db_path)
+    try:
+        cols = ", ".join(QUOTE_COLUMNS)
+        df = pd.read_sql_query(f"SELECT {cols} FROM quotes ORDER BY id", conn)
+    finally:
         conn.close()
     return df
 
-def get_all_quotes():
-    return st.session_state.get("quotes_df", pd.DataFrame())
+# === Truy cập dữ liệu trực tiếp trên file SQLite cục bộ ===
+
+PAGE_SIZE = 50
+LIST_COLUMNS = ["id", "content", "tag"]
+
 
-def get_random_quote(df=None):
-    if df is None:
-        df = st.session_state.get("quotes_df")
-    if df is None or df.empty:
+def _query(db_path, sql, params=()):
+    with perf_span("sqlite.query", sql=" ".join(sql.split())[:80]) as span:
+        conn = connect_existing(db_path)
+        conn.row_factory = sqlite3.Row
+        try:
+            rows = [dict(row) for row in conn.execute(sql, params)]
+        finally:
+            conn.close()
+        span["rows"] = len(rows)
+    return rows
+
+
+def count_quotes(db_path):
+    return _query(db_path, "SELECT COUNT(*) AS n FROM quotes")[0]["n"]
+
+
+def fetch_quote(db_path, quote_id):
+    """Lấy một quote theo id qua PRIMARY KEY"""
+    cols = ", ".join(QUOTE_COLUMNS)
+    rows = _query(db_path, f"SELECT {cols} FROM quotes WHERE id = ?", (int(quote_id),))
+    return rows[0] if rows else None
+
+
+def fetch_quotes_by_ids(db_path, ids, columns=QUOTE_COLUMNS):
+    """Lấy các quote theo danh sách id, giữ đúng thứ tự của ids"""
+    ids = [int(i) for i in ids]
+    if not ids:
+        return []
+    cols = ", ".join(columns if "id" in columns else ["id"] + list(columns))
+    by_id = {}
+    # Giới hạn số tham số của SQLite
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        placeholders = ", ".join("?" * len(chunk))
+        for row in _query(db_path, f"SELECT {cols} FROM quotes WHERE id IN ({placeholders})", chunk):
+            by_id[row["id"]] = row
+    return [by_id[i] for i in ids if i in by_id]
+
+
+@perf_timed("sqlite.copy")
+def copy_quotes_between(source_path, target_path, ids):
+    """Chép các quote theo id từ file nguồn sang file đích bằng một câu INSERT ... SELECT qua ATTACH.
+
+    Không chép cột id để AUTOINCREMENT của file đích cấp id mới, tránh đụng id sẵn có.
+    Trả về số dòng đã chép."""
+    ids = [int(i) for i in ids]
+    if not ids:
+        return 0
+    conn = connect_existing(target_path)
+    try:
+        conn.execute("ATTACH DATABASE ? AS src", (db_uri(source_path, "ro"),))
+        conn.execute("CREATE TEMP TABLE transfer_ids (pos INTEGER PRIMARY KEY, id INTEGER NOT NULL)")
+        with conn:
+            conn.executemany("INSERT INTO temp.transfer_ids (id) VALUES (?)", [(i,) for i in ids])
+            cols = ", ".join(QUOTE_COLUMNS[1:])
+            # Giữ thứ tự đã chọn, bỏ id trùng trong danh sách chọn
+            cur = conn.execute(
+                f"INSERT INTO main.quotes ({cols}) "
+                f"SELECT {', '.join('q.' + c for c in QUOTE_COLUMNS[1:])} FROM src.quotes q "
+                "JOIN (SELECT id, MIN(pos) AS pos FROM temp.transfer_ids GROUP BY id) t ON t.id = q.id "
+                "ORDER BY t.pos"
+            )
+            copied = cur.rowcount
+        conn.execute("DETACH DATABASE src")
+    finally:
+        conn.close()
+    return copied
+
+
+def fetch_page(db_path, after_id=None, limit=PAGE_SIZE, columns=LIST_COLUMNS):
+    """Một trang quote theo id tăng dần (keyset: id > after_id), không dùng OFFSET"""
+    cols = ", ".join(columns)
+    if after_id is None:
+        return _query(db_path, f"SELECT {cols} FROM quotes ORDER BY id LIMIT ?", (limit,))
+    return _query(db_path, f"SELECT {cols} FROM quotes WHERE id > ? ORDER BY id LIMIT ?", (int(after_id), limit))
+
+
+def fetch_all_ids(db_path):
+    return [row["id"] for row in _query(db_path, "SELECT id FROM quotes ORDER BY id")]
+
+
+def quote_label(row):
+    return f"{row['id']} | {(row['content'] or '')[:50]}..."
+
+
+def _pager_nav(key, page, has_next, caption):
+    col_prev, col_info, col_next = st.columns([1, 3, 1])
+    go_prev = col_prev.button("◀", key=f"{key}_prev", disabled=page == 0)
+    col_info.caption(caption)
+    go_next = col_next.button("▶", key=f"{key}_next", disabled=not has_next)
+    return go_prev, go_next
+
+
+PAGER_KEYS = ("list_all", "edit_all", "edit_search", "delete_all", "delete_search")
+
+
+def reset_pagers():
+    """Đưa mọi danh sách về trang đầu; con trỏ keyset là id nên không dùng lại được khi đổi database hay đổi id"""
+    for key in PAGER_KEYS:
+        st.session_state.pop(f"{key}_cursors", None)
+        st.session_state.pop(f"{key}_page", None)
+
+
+def page_table(key, db_path, columns=LIST_COLUMNS):
+    """Trang hiện tại của cả bảng, chuyển trang theo keyset (lưu id đầu trang trong session)"""
+    cursors = st.session_state.setdefault(f"{key}_cursors", [None])
+    rows = fetch_page(db_path, cursors[-1], PAGE_SIZE + 1, columns)
+    has_next = len(rows) > PAGE_SIZE
+    rows = rows[:PAGE_SIZE]
+    total = count_quotes(db_path)
+    pages = max(1, -(-total // PAGE_SIZE))
+    go_prev, go_next = _pager_nav(key, len(cursors) - 1, has_next, f"Trang {len(cursors)}/{pages} · {total} quote")
+    if go_prev:
+        cursors.pop()
+        st.rerun()
+    if go_next:
+        cursors.append(rows[-1]["id"])
+        st.rerun()
+    return rows
+
+
+def page_ids(key, ids, total=None):
+    """Cắt danh sách id (kết quả tìm kiếm) thành các trang PAGE_SIZE.
+
+    total: tổng số kết quả thật khi ids chỉ là phần khớp nhất (tìm kiếm có LIMIT)"""
+    page = st.session_state.get(f"{key}_page", 0)
+    if page * PAGE_SIZE >= len(ids):
+        page = 0
+    pages = max(1, -(-len(ids) // PAGE_SIZE))
+    has_next = (page + 1) * PAGE_SIZE < len(ids)
+    caption = f"Trang {page + 1}/{pages} · {len(ids)} kết quả"
+    if total is not None and total > len(ids):
+        caption = f"Trang {page + 1}/{pages} · {total} kết quả (hiện {len(ids)} khớp nhất)"
+    go_prev, go_next = _pager_nav(key, page, has_next, caption)
+    if go_prev or go_next:
+        st.session_state[f"{key}_page"] = page - 1 if go_prev else page + 1
+        st.rerun()
+    return ids[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]
+
+# === Tìm kiếm FTS5 ===
+
+def build_fts_query(text):
+    """Mỗi từ thành một tiền tố "từ"*, các từ nối với nhau bằng AND"""
+    words = re.findall(r"\w+", text.replace("đ", "d").replace("Đ", "D"))
+    return " ".join(f'"{w}"*' for w in words)
+
+
+@perf_timed("search")
+def search_quote_ids(db_path, text, limit=SEARCH_LIMIT):
+    """id các quote khớp với text, xếp theo độ liên quan (bm25)"""
+    query = build_fts_query(text)
+    if not query:
+        return []
+    try:
+        rows = _query(
+            db_path,
+            "SELECT rowid AS id FROM quotes_fts WHERE quotes_fts MATCH ? ORDER BY rank LIMIT ?",
+            (query, limit)
+        )
+    except sqlite3.OperationalError:
+        # Không có FTS5: quét LIKE trên SQLite
+        pattern = f"%{text.strip()}%"
+        rows = _query(
+            db_path,
+            "SELECT id FROM quotes WHERE content LIKE ? OR tag LIKE ? ORDER BY id LIMIT ?",
+            (pattern, pattern, limit)
+        )
+    return [row["id"] for row in rows]
+
+
+def _search_all(db_path, text, select):
+    query = build_fts_query(text)
+    if not query:
+        return []
+    try:
+        return _query(db_path, f"SELECT {select} FROM quotes_fts WHERE quotes_fts MATCH ?", (query,))
+    except sqlite3.OperationalError:
+        pattern = f"%{text.strip()}%"
+        return _query(
+            db_path, f"SELECT {select.replace('rowid', 'id')} FROM quotes WHERE content LIKE ? OR tag LIKE ?",
+            (pattern, pattern)
+        )
+
+
+def search_all_quote_ids(db_path, text):
+    """Mọi id khớp với text (không LIMIT, không xếp hạng), dùng cho ô chọn tất cả mọi trang"""
+    return [row["id"] for row in _search_all(db_path, text, "rowid AS id")]
+
+
+def count_search_matches(db_path, text):
+    rows = _search_all(db_path, text, "COUNT(*) AS n")
+    return rows[0]["n"] if rows else 0
+
+
+# === Tìm trên mọi database của thư mục ===
+
+FOLDER_SEARCH_WORKERS = int(os.environ.get("QUOTE_FOLDER_SEARCH_WORKERS", "8"))
+FOLDER_SEARCH_LIMIT = 50
+
+
+def search_db_file(db_file, text, limit=FOLDER_SEARCH_LIMIT):
+    """Lấy file DB từ cache (tải về nếu cũ) rồi tìm thẳng trên SQLite của nó.
+
+    File được ghim suốt lúc tìm để các luồng khác tải file về không xoá mất nó khỏi cache."""
+    with get_cache_pins().hold(db_file["id"]):
+        db_path = fetch_db_file(db_file["id"])
+        return fetch_quotes_by_ids(db_path, search_quote_ids(db_path, text, limit), LIST_COLUMNS)
+
+
+def search_folder(db_files, text, limit=FOLDER_SEARCH_LIMIT, workers=FOLDER_SEARCH_WORKERS):
+    """Tìm song song trên mọi file DB với tối đa `workers` luồng.
+
+    Trả dần từng bộ (file, rows, lỗi) theo thứ tự file nào xong trước. Dừng giữa chừng
+    (vd. người dùng rerun) thì các file chưa bắt đầu bị huỷ, không chờ."""
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="folder-search")
+    try:
+        futures = {pool.submit(search_db_file, db_file, text, limit): db_file for db_file in db_files}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], [], e
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+# === Nhập/xuất hàng loạt (CSV/JSONL) ===
+
+IMPORT_CHUNK_ROWS = 1000
+IMPORT_FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl"}
+
+
+def clean_quote_row(raw):
+    """Làm sạch một quote như form thêm quote; trả về None nếu mọi trường đều rỗng"""
+    def text(key):
+        value = raw.get(key)
+        return "" if value is None else str(value).strip()
+
+    tags = raw.get("tag")
+    if isinstance(tags, (list, tuple)):
+        tag_list = [str(t).strip() for t in tags if t is not None]
+    else:
+        tag_list = split_tags(text("tag"))
+    row = {
+        "content": text("content"),
+        "speaker": text("speaker"),
+        "note": text("note"),
+        "date": text("date"),
+        "tag": " ".join(dict.fromkeys(t for t in tag_list if t)),
+        "link": text("link"),
+    }
+    if not any(row.values()):
         return None
-    return df.sample(1).iloc[0].to_dict()
-def update_reload():
-    global selected_db_file
-    df_to_save = st.session_state.get("quotes_df")
-    if df_to_save is not None and not df_to_save.empty:
+    cleaned_content = row["content"].strip('"').replace('"', "'")
+    row["content"] = f'"{cleaned_content}"'
+    return row
+
+
+def content_key(content):
+    """Khoá so trùng nội dung: bỏ ngoặc kép, gộp khoảng trắng, không phân biệt hoa thường"""
+    normalized = " ".join(unicodedata.normalize("NFC", (content or "").strip().strip('"')).casefold().split())
+    return int.from_bytes(hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).digest(), "big", signed=True)
+
+
+def import_format(filename):
+    return IMPORT_FORMATS.get(os.path.splitext(filename.lower())[1])
+
+
+def read_import_rows(fh, fmt):
+    """Đọc từng dòng từ luồng văn bản CSV (có dòng tiêu đề) hoặc JSONL, không nạp cả file"""
+    if fmt == "csv":
+        yield from csv.DictReader(fh)
+    elif fmt == "jsonl":
+        for line_no, line in enumerate(fh, 1):
+            if line.strip():
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"Dòng {line_no} không phải JSON hợp lệ: {e}") from e
+                if not isinstance(row, dict):
+                    raise ValueError(f"Dòng {line_no}: mỗi dòng phải là một object JSON, không phải {type(row).__name__}")
+                yield row
+    else:
+        raise ValueError(f"Định dạng không hỗ trợ: {fmt}")
+
+
+def discard_export():
+    """Xoá file xuất đang chờ tải (sau khi tải xong, khi chuẩn bị file mới hoặc khi đổi database)"""
+    export = st.session_state.pop("bulk_export", None)
+    if export and os.path.exists(export[0]):
+        os.remove(export[0])
+
+
+@perf_timed("sqlite.import")
+def import_quotes(db_path, rows, dedupe=True, chunk_size=IMPORT_CHUNK_ROWS, progress=None):
+    """Thêm các quote từ rows (iterable dict) trong một transaction, mỗi lô một executemany.
+
+    id do AUTOINCREMENT cấp. Khi dedupe, bỏ qua quote có nội dung trùng với quote đã có
+    hoặc đã nhập trước đó trong cùng lượt. Trả về dict số dòng đã thêm / trùng / rỗng."""
+    stats = {"inserted": 0, "duplicates": 0, "empty": 0}
+    cols = ", ".join(QUOTE_COLUMNS[1:])
+    conn = connect_existing(db_path)
+    try:
+        if dedupe:
+            conn.create_function("content_key", 1, content_key, deterministic=True)
+            conn.execute("CREATE TEMP TABLE import_seen (key INTEGER PRIMARY KEY)")
+            conn.execute("INSERT OR IGNORE INTO import_seen SELECT content_key(content) FROM quotes")
+        with conn:
+            for chunk in _batched(rows, chunk_size):
+                cleaned = []
+                for raw in chunk:
+                    row = clean_quote_row(raw)
+                    if row is None:
+                        stats["empty"] += 1
+                    else:
+                        cleaned.append(row)
+                if dedupe and cleaned:
+                    keyed = {}
+                    for row in cleaned:
+                        keyed.setdefault(content_key(row["content"]), row)
+                    stats["duplicates"] += len(cleaned) - len(keyed)
+                    keys = list(keyed)
+                    seen = set()
+                    for start in range(0, len(keys), 500):
+                        part = keys[start:start + 500]
+                        seen.update(k for (k,) in conn.execute(
+                            f"SELECT key FROM import_seen WHERE key IN ({', '.join('?' * len(part))})", part
+                        ))
+                    stats["duplicates"] += len(seen)
+                    cleaned = [row for key, row in keyed.items() if key not in seen]
+                    conn.executemany("INSERT INTO import_seen (key) VALUES (?)", [(k,) for k in keys if k not in seen])
+                conn.executemany(
+                    f"INSERT INTO quotes ({cols}) VALUES ({', '.join('?' * (len(QUOTE_COLUMNS) - 1))})",
+                    [_quote_params(row) for row in cleaned]
+                )
+                stats["inserted"] += len(cleaned)
+                if progress:
+                    progress(stats)
+    finally:
+        conn.close()
+    return stats
+
+
+def _batched(iterable, n):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, n)):
+        yield chunk
+
+
+@perf_timed("sqlite.export")
+def export_quotes(db_path, fh, fmt, chunk_size=IMPORT_CHUNK_ROWS):
+    """Ghi toàn bộ quote ra luồng văn bản fh theo từng lô, trả về số dòng đã ghi"""
+    conn = connect_existing(db_path)
+    try:
+        cursor = conn.execute(f"SELECT {', '.join(QUOTE_COLUMNS)} FROM quotes ORDER BY id")
+        if fmt == "csv":
+            writer = csv.writer(fh)
+            writer.writerow(QUOTE_COLUMNS)
+        elif fmt != "jsonl":
+            raise ValueError(f"Định dạng không hỗ trợ: {fmt}")
+        count = 0
+        while rows := cursor.fetchmany(chunk_size):
+            if fmt == "csv":
+                writer.writerows(rows)
+            else:
+                fh.writelines(json.dumps(dict(zip(QUOTE_COLUMNS, row)), ensure_ascii=False) + "\n" for row in rows)
+            count += len(rows)
+    finally:
+        conn.close()
+    return count
+
+
+# === Chỉ mục tag ===
+
+def split_tags(tag):
+    return tag.split() if isinstance(tag, str) else []
+
+
+class QuoteStore:
+    """Bản nén, chỉ đọc, của cột speaker và tag của một file DB; mọi phiên mở cùng bản file dùng chung.
+
+    speaker và tag được mã hoá từ điển (mã int32). Quan hệ quote–tag là ma trận thưa,
+    lưu cả theo dòng (row_ptr/row_tags) lẫn theo tag (tag_ptr/tag_rows). Nội dung quote
+    không nạp vào RAM mà vẫn đọc thẳng từ file SQLite."""
+
+    def __init__(self, ids, speakers, tags):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.size = len(self.ids)
+        speaker_vocab = {}
+        self.speaker_codes = np.fromiter(
+            (speaker_vocab.setdefault(sp or "", len(speaker_vocab)) for sp in speakers), dtype=np.int32, count=self.size
+        )
+        self.speaker_vocab = list(speaker_vocab)
+        self.tag_code = {}
+        codes, lengths = [], []
+        for tag in tags:
+            row = [self.tag_code.setdefault(t, len(self.tag_code)) for t in dict.fromkeys(split_tags(tag))]
+            codes.extend(row)
+            lengths.append(len(row))
+        self.tag_vocab = list(self.tag_code)
+        self.row_ptr = np.zeros(self.size + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.row_ptr[1:])
+        self.row_tags = np.array(codes, dtype=np.int32)
+        row_of = np.repeat(np.arange(self.size, dtype=np.int32), lengths)
+        self.tag_rows = row_of[np.argsort(self.row_tags, kind="stable")]
+        self.tag_ptr = np.zeros(len(self.tag_vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.row_tags, minlength=len(self.tag_vocab)), out=self.tag_ptr[1:])
+
+    def position(self, quote_id):
+        pos = int(np.searchsorted(self.ids, quote_id))
+        if pos < self.size and self.ids[pos] == quote_id:
+            return pos
+        return None
+
+    def rows_with(self, tag):
+        code = self.tag_code.get(tag)
+        if code is None:
+            return self.tag_rows[:0]
+        return self.tag_rows[self.tag_ptr[code]:self.tag_ptr[code + 1]]
+
+    def tags_at(self, pos):
+        return [self.tag_vocab[c] for c in self.row_tags[self.row_ptr[pos]:self.row_ptr[pos + 1]]]
+
+    def speaker_at(self, pos):
+        return self.speaker_vocab[self.speaker_codes[pos]]
+
+    def tag_counts(self):
+        return dict(zip(self.tag_vocab, np.diff(self.tag_ptr).tolist()))
+
+    def speaker_counts(self):
+        return dict(zip(self.speaker_vocab, np.bincount(self.speaker_codes, minlength=len(self.speaker_vocab)).tolist()))
+
+    def nbytes(self):
+        arrays = (self.ids, self.speaker_codes, self.row_ptr, self.row_tags, self.tag_rows, self.tag_ptr)
+        vocab = sum(sys.getsizeof(v) for v in self.speaker_vocab) + sum(sys.getsizeof(v) for v in self.tag_vocab)
+        return sum(a.nbytes for a in arrays) + vocab
+
+
+@st.cache_resource(show_spinner=False)
+def quote_store_registry():
+    """db_path -> (dấu thời gian file, QuoteStore) của bản mới nhất, dùng chung cho mọi phiên"""
+    return {"stores": {}, "lock": threading.Lock()}
+
+
+@perf_timed("quote_store")
+def get_quote_store(db_path):
+    """QuoteStore của nội dung hiện tại của file; chỉ dựng lại khi file đã bị ghi từ lần dựng trước"""
+    stat = os.stat(db_path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    registry = quote_store_registry()
+    with registry["lock"]:
+        entry = registry["stores"].get(db_path)
+        if entry is None or entry[0] != stamp:
+            rows = _query(db_path, "SELECT id, speaker, tag FROM quotes ORDER BY id")
+            # Bản cũ vẫn sống tới khi các phiên đang giữ nó nạp lại
+            entry = registry["stores"][db_path] = (stamp, QuoteStore(
+                [row["id"] for row in rows], [row["speaker"] for row in rows], [row["tag"] for row in rows]
+            ))
+    return entry[1]
+
+
+VOCAB_SUGGEST_LIMIT = 500
+
+
+def fold_term(text):
+    """Khoá tra tiền tố: bỏ dấu (kể cả đ), không phân biệt hoa thường, bỏ # ở đầu tag"""
+    decomposed = unicodedata.normalize("NFD", text.replace("đ", "d").replace("Đ", "D"))
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold().lstrip("#")
+
+
+class Vocabulary:
+    """Các speaker (hoặc tag) đang dùng kèm số quote dùng nó, tra gợi ý theo tiền tố"""
+
+    def __init__(self, counts):
+        self.counts = {term: n for term, n in counts.items() if term and n > 0}
+        self._keys = None  # [(fold_term(term), term)] đã sắp xếp, dựng lại khi có term mới
+        self._names = None
+        self._suggested = {}  # (prefix, limit) -> kết quả, xoá khi số đếm đổi
+
+    def adjust(self, term, delta):
+        if not term:
+            return
+        self._suggested.clear()
+        n = self.counts.get(term, 0) + delta
+        if n > 0:
+            if term not in self.counts:
+                self._keys = self._names = None
+            self.counts[term] = n
+        elif self.counts.pop(term, None) is not None:
+            # _keys vẫn giữ term đã hết dùng, suggest() tự bỏ qua
+            self._names = None
+
+    def names(self):
+        if self._names is None:
+            self._names = sorted(self.counts)
+        return self._names
+
+    def suggest(self, prefix="", limit=VOCAB_SUGGEST_LIMIT):
+        """Tối đa limit term bắt đầu bằng prefix, dùng nhiều nhất trước"""
+        cached = self._suggested.get((prefix, limit))
+        if cached is not None:
+            return list(cached)
+        if self._keys is None:
+            self._keys = sorted((fold_term(term), term) for term in self.counts)
+        key = fold_term(prefix)
+        lo = bisect.bisect_left(self._keys, (key,))
+        hi = bisect.bisect_left(self._keys, (key + "\U0010ffff",))
+        matches = (term for _, term in itertools.islice(self._keys, lo, hi) if term in self.counts)
+        result = heapq.nsmallest(limit, matches, key=lambda term: (-self.counts[term], term))
+        self._suggested[(prefix, limit)] = result
+        return list(result)
+
+
+class TagIndex:
+    """Chỉ mục tag của một phiên: QuoteStore dùng chung cộng lớp phủ các dòng phiên này đã thêm/sửa/xoá.
+
+    Lớp phủ chỉ giữ id -> (speaker, tập tag), hoặc None nếu đã xoá."""
+
+    def __init__(self, store):
+        self.store = store
+        self.overlay = {}
+        self._shadowed = set()  # id trong lớp phủ có sẵn trong store
+        # Tăng sau mỗi lần thêm/sửa/xoá để các bộ bốc random biết dữ liệu đã đổi
+        self.version = 0
+        self._vocab = None  # {"speaker": Vocabulary, "tag": Vocabulary}, dựng khi cần lần đầu
+
+    @property
+    def size(self):
+        added = sum(1 for quote_id, value in self.overlay.items() if value is not None and quote_id not in self._shadowed)
+        deleted = sum(1 for quote_id in self._shadowed if self.overlay[quote_id] is None)
+        return self.store.size + added - deleted
+
+    def _current(self, quote_id):
+        """(speaker, tập tag) hiện tại của một id, None nếu không có"""
+        if quote_id in self.overlay:
+            return self.overlay[quote_id]
+        pos = self.store.position(quote_id)
+        if pos is None:
+            return None
+        return self.store.speaker_at(pos), self.store.tags_at(pos)
+
+    def _count_vocab(self, value, delta):
+        if value is not None:
+            self._vocab["speaker"].adjust(value[0], delta)
+            for t in value[1]:
+                self._vocab["tag"].adjust(t, delta)
+
+    def _set(self, quote_id, value):
+        quote_id = int(quote_id)
+        if self._vocab is not None:
+            self._count_vocab(self._current(quote_id), -1)
+            self._count_vocab(value, 1)
+        self.overlay[quote_id] = value
+        if self.store.position(quote_id) is not None:
+            self._shadowed.add(quote_id)
+        self.version += 1
+
+    def vocabulary(self, kind):
+        """Vocabulary của "speaker" hoặc "tag"; dựng một lần từ QuoteStore rồi cập nhật theo từng thay đổi"""
+        if self._vocab is None:
+            self._vocab = {"speaker": Vocabulary(self.store.speaker_counts()), "tag": Vocabulary(self.store.tag_counts())}
+            for quote_id in self._shadowed:
+                pos = self.store.position(quote_id)
+                self._count_vocab((self.store.speaker_at(pos), self.store.tags_at(pos)), -1)
+            for value in self.overlay.values():
+                self._count_vocab(value, 1)
+        return self._vocab[kind]
+
+    def tags(self):
+        return self.vocabulary("tag").names()
+
+    def speakers(self):
+        return self.vocabulary("speaker").names()
+
+    def add(self, row):
+        self._set(row["id"], (row.get("speaker") or "", frozenset(split_tags(row.get("tag")))))
+
+    update = add
+
+    def delete(self, quote_ids):
+        for quote_id in quote_ids:
+            self._set(quote_id, None)
+
+    def rekey(self, old_id, new_id):
+        """Chuyển dòng phủ của một id tạm (temp_quote_id, không có trong store) sang id thật"""
+        value = self.overlay.pop(int(old_id), None)
+        if value is None:
+            return
+        if self._vocab is not None:
+            self._count_vocab(value, -1)
+        self._set(new_id, value)
+
+    @perf_timed("tag_index.filter")
+    def filter(self, included_tags, excluded_tags):
+        """id các dòng có ít nhất một tag trong included và không có tag nào trong excluded"""
+        store = self.store
+        if included_tags:
+            ok = np.zeros(store.size, dtype=bool)
+            for t in included_tags:
+                ok[store.rows_with(t)] = True
+        else:
+            ok = np.ones(store.size, dtype=bool)
+        for t in excluded_tags:
+            ok[store.rows_with(t)] = False
+        if self._shadowed:
+            ok[[store.position(quote_id) for quote_id in self._shadowed]] = False
+        ids = store.ids[ok]
+        included, excluded = set(included_tags), set(excluded_tags)
+        extra = [
+            quote_id for quote_id, value in self.overlay.items()
+            if value is not None and (not included or value[1] & included) and not value[1] & excluded
+        ]
+        return np.sort(np.concatenate([ids, np.array(extra, dtype=np.int64)])) if extra else ids
+
+    def weights(self, ids, tag_weights):
+        """Trọng số của từng id: nhỏ nhất trong các trọng số của tag nó mang (mặc định 1)"""
+        store = self.store
+        ids = np.asarray(ids, dtype=np.int64)
+        weights = np.ones(len(ids))
+        positions = np.minimum(np.searchsorted(store.ids, ids), max(store.size - 1, 0))
+        in_base = (store.ids[positions] == ids) if store.size else np.zeros(len(ids), dtype=bool)
+        for t, w in tag_weights.items():
+            member = np.zeros(store.size, dtype=bool)
+            member[store.rows_with(t)] = True
+            hit = in_base & member[positions] if store.size else in_base
+            weights[hit] = np.minimum(weights[hit], w)
+        for n, quote_id in enumerate(ids.tolist()):
+            value = self.overlay.get(quote_id)
+            if value is not None:
+                weights[n] = min([1.0] + [w for t, w in tag_weights.items() if t in value[1]])
+        return weights
+
+    def overlay_nbytes(self):
+        return sys.getsizeof(self.overlay) + sum(
+            sys.getsizeof(value) + (sum(sys.getsizeof(t) for t in value[1]) if value else 0)
+            for value in self.overlay.values()
+        )
+
+
+TAG_OVERLAY_MAX = 5000
+
+
+def get_tag_index(db_path):
+    """Chỉ mục tag của database đang mở, chỉ dựng lại khi đổi database hoặc lớp phủ đã quá lớn"""
+    index = st.session_state.get("tag_index")
+    if (
+        index is None
+        or st.session_state.get("tag_index_db") != st.session_state.get("selected_db_id")
+        or len(index.overlay) > TAG_OVERLAY_MAX
+    ):
+        index = TagIndex(get_quote_store(db_path))
+        st.session_state["tag_index"] = index
+        st.session_state["tag_index_db"] = st.session_state.get("selected_db_id")
+    return index
+
+
+def memory_panel(db_files):
+    """Bộ nhớ của các bản QuoteStore dùng chung và lớp phủ của phiên hiện tại"""
+    names = {cache_paths(f["id"])[0]: f["name"] for f in db_files}
+    registry = quote_store_registry()
+    with registry["lock"]:
+        stores = list(registry["stores"].items())
+    for db_path, (_, store) in stores:
+        name = names.get(db_path, os.path.basename(db_path))
+        st.caption(f"`{name}`: {store.size} quote, {store.nbytes() / 2 ** 20:.2f} MB dùng chung")
+    index = st.session_state.get("tag_index")
+    if index is not None:
+        st.caption(f"Lớp phủ của phiên này: {len(index.overlay)} dòng, {index.overlay_nbytes() / 1024:.1f} KB")
+
+
+PENDING_WEIGHT = 0.25
+
+
+class QuoteSampler:
+    """Bốc quote ngẫu nhiên không lặp lại trên tập id đã lọc theo tag.
+
+    Mỗi vòng là một "bag" đã xáo của các id hợp lệ; mỗi lần bốc lấy phần tử cuối bag
+    (O(1)), hết bag mới xáo vòng mới. Id có trọng số w < 1 chỉ được đưa vào mỗi vòng
+    với xác suất w. Khi dữ liệu đổi, sync() giữ nguyên vòng đang dở thay vì xáo lại."""
+
+    def __init__(self, tag_index, included_tags, excluded_tags, tag_weights=None):
+        self.source = tag_index
+        self.key = (frozenset(included_tags), frozenset(excluded_tags), tuple(sorted((tag_weights or {}).items())))
+        self.rng = random.Random()
+        self.bag = []
+        self.cycle = set()  # id đã được xét trong vòng hiện tại (còn trong bag, đã bốc hoặc bị bỏ qua)
+        self.current = None
+        self._load()
+
+    def _load(self):
+        included_tags, excluded_tags, tag_weights = self.key
+        ids = self.source.filter(included_tags, excluded_tags)
+        self.version = self.source.version
+        self.ids = ids.tolist()
+        self.weights = dict(zip(self.ids, self.source.weights(ids, dict(tag_weights)).tolist())) if tag_weights else {}
+
+    def matches(self, tag_index, included_tags, excluded_tags, tag_weights=None):
+        key = (frozenset(included_tags), frozenset(excluded_tags), tuple(sorted((tag_weights or {}).items())))
+        return self.source is tag_index and self.key == key
+
+    def _admit(self, ids):
+        return [i for i in ids if self.weights.get(i, 1.0) >= 1.0 or self.rng.random() < self.weights[i]]
+
+    def sync(self):
+        """Cập nhật theo dữ liệu mới của chỉ mục tag, giữ vòng đang dở"""
+        if self.version == self.source.version:
+            return
+        self._load()
+        eligible = set(self.ids)
+        self.bag = [i for i in self.bag if i in eligible]
+        new = self._admit([i for i in self.ids if i not in self.cycle])
+        self.cycle.update(new)
+        self.bag.extend(new)
+        self.rng.shuffle(self.bag)
+        if self.current not in eligible:
+            self.current = None
+
+    def _refill(self):
+        bag = self._admit(self.ids) or list(self.ids)
+        self.rng.shuffle(bag)
+        # Không để quote vừa hiện mở đầu vòng mới
+        if len(bag) > 1 and bag[-1] == self.current:
+            bag[0], bag[-1] = bag[-1], bag[0]
+        self.bag = bag
+        self.cycle = set(self.ids)
+
+    def draw(self):
+        if not self.ids:
+            self.current = None
+            return None
+        if not self.bag:
+            self._refill()
+        self.current = self.bag.pop()
+        return self.current
+
+    def peek(self):
+        """Quote đang hiện; chỉ bốc mới khi chưa có"""
+        return self.current if self.current is not None else self.draw()
+
+    def discard(self, quote_id):
+        """Bỏ hẳn một id (vd. phiên khác đã xoá quote khỏi file dùng chung)"""
+        self.ids = [i for i in self.ids if i != quote_id]
+        self.bag = [i for i in self.bag if i != quote_id]
+        self.cycle.discard(quote_id)
+        self.weights.pop(quote_id, None)
+        if self.current == quote_id:
+            self.current = None
+
+    def remaining(self):
+        return len(self.bag)
+
+
+def get_quote_sampler(db_path, included_tags, excluded_tags, tag_weights=None):
+    """Bộ bốc random của phiên, chỉ tạo lại khi đổi database hoặc đổi bộ lọc"""
+    tag_index = get_tag_index(db_path)
+    sampler = st.session_state.get("quote_sampler")
+    if sampler is None or not sampler.matches(tag_index, included_tags, excluded_tags, tag_weights):
+        sampler = QuoteSampler(tag_index, included_tags, excluded_tags, tag_weights)
+        st.session_state["quote_sampler"] = sampler
+    else:
+        sampler.sync()
+    return sampler
+
+
+def get_random_quote(db_path=None):
+    db_path = db_path or st.session_state.get("local_db_path")
+    if db_path is None:
+        return None
+    return sampled_quote(db_path, get_quote_sampler(db_path, [], []), fresh=True)
+
+
+def sampled_quote(db_path, sampler, fresh=False):
+    """Quote đang hiện của sampler (hoặc bốc mới nếu fresh).
+
+    File cache dùng chung giữa các phiên nên id có thể đã bị phiên khác xoá: id nào không
+    còn dòng thì bỏ khỏi sampler và chỉ mục tag rồi bốc tiếp, tới khi có quote hoặc hết."""
+    quote_id = sampler.draw() if fresh else sampler.peek()
+    while quote_id is not None:
+        quote = fetch_quote(db_path, quote_id)
+        if quote is not None:
+            return quote
+        sampler.discard(quote_id)
+        sampler.source.delete([quote_id])
+        quote_id = sampler.draw()
+    return None
+
+
+# === Phát hiện quote gần trùng (MinHash + LSH) ===
+
+NEAR_DUP_PERMUTATIONS = 64
+NEAR_DUP_BANDS = 16
+NEAR_DUP_THRESHOLD = 0.5
+NEAR_DUP_BATCH = 50000
+# Mỗi chỉ mục giữ ~400 byte/dòng (chữ ký + khoá band) trong RAM; chỉ giữ chỉ mục của vài file gần nhất
+NEAR_DUP_MAX_INDEXES = int(os.environ.get("QUOTE_NEAR_DUP_MAX_INDEXES", "4"))
+_SHINGLE_MULT = np.uint64(2654435761)
+
+
+@st.cache_resource(show_spinner=False)
+def minhash_tables():
+    """Các bảng hằng của MinHash, tính một lần cho cả tiến trình thay vì ở mỗi lần rerun"""
+    rng = np.random.RandomState(20240617)
+    return {
+        # Băm multiply-shift: ((a * h + b) mod 2^64) >> 32, a lẻ
+        "a": rng.randint(0, 2 ** 63, NEAR_DUP_PERMUTATIONS, dtype=np.uint64) | np.uint64(1),
+        "b": rng.randint(0, 2 ** 63, NEAR_DUP_PERMUTATIONS, dtype=np.uint64),
+        "band_mult": rng.randint(0, 2 ** 63, NEAR_DUP_PERMUTATIONS // NEAR_DUP_BANDS, dtype=np.uint64) | np.uint64(1),
+        "char_powers": np.concatenate([[1], np.cumprod(np.full(63, 1099511628211, dtype=np.uint64))]).astype(np.uint64),
+        # Ký tự thuộc "từ" như \\w của re (chữ, số, _) trong BMP, tra bằng numpy thay vì regex
+        "word_chars": np.array([chr(c).isalnum() or c == 0x5F for c in range(0x10000)] + [False], dtype=bool),
+    }
+
+
+def shingle_hashes(texts):
+    """Hash các cặp từ liên tiếp (bỏ dấu câu, ngoặc kép, chữ hoa) của từng quote.
+
+    Trả về (mảng hash, vị trí bắt đầu của mỗi quote trong mảng). Quote ít hơn
+    hai từ dùng chính từ đó (hoặc chuỗi rỗng) làm shingle duy nhất. Toàn bộ
+    lô được xử lý trên mảng mã ký tự nên không có vòng lặp Python theo từ.
+    """
+    big = unicodedata.normalize("NFC", "\x00".join((t or "").replace("\x00", " ") for t in texts).lower())
+    codes = np.frombuffer(big.encode("utf-32-le"), dtype=np.uint32)
+    tables = minhash_tables()
+    is_word = tables["word_chars"][np.minimum(codes, 0x10000)]
+    is_start = is_word & ~np.concatenate([[False], is_word[:-1]])
+    char_pos = np.flatnonzero(is_word)
+    word_start = np.flatnonzero(is_start)
+    word_of_char = np.cumsum(is_start)[char_pos] - 1
+    offset = np.minimum(char_pos - word_start[word_of_char], len(tables["char_powers"]) - 1)
+    mixed = codes[char_pos].astype(np.uint64) * tables["char_powers"][offset]
+    word_hash = np.add.reduceat(mixed, np.searchsorted(char_pos, word_start)) if len(word_start) else mixed
+    word_hash = (word_hash ^ (word_hash >> np.uint64(32))) & np.uint64(0xFFFFFFFF)
+    doc_of_word = np.cumsum(codes == 0)[word_start]
+
+    same_doc = doc_of_word[1:] == doc_of_word[:-1]
+    pair_doc = doc_of_word[:-1][same_doc]
+    pair_hash = (word_hash[:-1][same_doc] * _SHINGLE_MULT + word_hash[1:][same_doc]) & np.uint64(0xFFFFFFFF)
+
+    words_per_doc = np.bincount(doc_of_word, minlength=len(texts))
+    short_docs = np.flatnonzero(words_per_doc < 2)
+    single_hash = np.zeros(len(short_docs), dtype=np.uint64)
+    has_word = words_per_doc[short_docs] == 1
+    single_hash[has_word] = word_hash[np.searchsorted(doc_of_word, short_docs[has_word])]
+
+    docs = np.concatenate([pair_doc, short_docs])
+    order = np.argsort(docs, kind="stable")
+    starts = np.searchsorted(docs[order], np.arange(len(texts)))
+    return np.concatenate([pair_hash, single_hash])[order], starts
+
+
+def minhash_signatures(texts):
+    sigs = np.empty((len(texts), NEAR_DUP_PERMUTATIONS), dtype=np.uint32)
+    tables = minhash_tables()
+    for start in range(0, len(texts), NEAR_DUP_BATCH):
+        batch = texts[start:start + NEAR_DUP_BATCH]
+        hashes, starts = shingle_hashes(batch)
+        for k in range(NEAR_DUP_PERMUTATIONS):
+            permuted = (tables["a"][k] * hashes + tables["b"][k]) >> np.uint64(32)
+            sigs[start:start + len(batch), k] = np.minimum.reduceat(permuted, starts)
+    return sigs
+
+
+def lsh_band_keys(sigs):
+    rows = NEAR_DUP_PERMUTATIONS // NEAR_DUP_BANDS
+    bands = sigs.reshape(len(sigs), NEAR_DUP_BANDS, rows).astype(np.uint64)
+    return (bands * minhash_tables()["band_mult"]).sum(axis=2, dtype=np.uint64)
+
+
+def near_dup_path(db_path):
+    return os.path.splitext(db_path)[0] + ".minhash.npz"
+
+
+class NearDuplicateIndex:
+    """Chữ ký MinHash của từng quote, lưu cạnh file DB trong cache và cập nhật theo dòng đổi"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.stamp = None
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.crcs = np.zeros(0, dtype=np.uint32)
+        self.sigs = np.zeros((0, NEAR_DUP_PERMUTATIONS), dtype=np.uint32)
+        self.keys = lsh_band_keys(self.sigs)
+        self._clusters = {}
+        try:
+            with np.load(near_dup_path(db_path)) as saved:
+                self.ids, self.crcs, self.sigs = saved["ids"], saved["crcs"], saved["sigs"]
+            self.keys = lsh_band_keys(self.sigs)
+        except (OSError, KeyError, ValueError):
+            pass
+
+    def _file_stamp(self):
+        stat = os.stat(self.db_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    @perf_timed("near_dup.refresh")
+    def refresh(self):
+        """Tính lại chữ ký cho các dòng mới hoặc có content đổi (so theo crc32)"""
+        with self.lock:
+            stamp = self._file_stamp()
+            if stamp == self.stamp:
+                return self
+            conn = connect_existing(self.db_path)
+            try:
+                rows = conn.execute("SELECT id, content FROM quotes ORDER BY id").fetchall()
+            finally:
+                conn.close()
+            ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+            contents = [r[1] or "" for r in rows]
+            crcs = np.fromiter((zlib.crc32(c.encode("utf-8")) for c in contents), dtype=np.uint32, count=len(rows))
+
+            if not (np.array_equal(ids, self.ids) and np.array_equal(crcs, self.crcs)):
+                sigs = np.empty((len(ids), NEAR_DUP_PERMUTATIONS), dtype=np.uint32)
+                pos = np.searchsorted(self.ids, ids)
+                pos_clipped = np.minimum(pos, max(len(self.ids) - 1, 0))
+                reuse = (pos < len(self.ids)) & (self.ids[pos_clipped] == ids) & (self.crcs[pos_clipped] == crcs) \
+                    if len(self.ids) else np.zeros(len(ids), dtype=bool)
+                sigs[reuse] = self.sigs[pos_clipped[reuse]]
+                changed = np.flatnonzero(~reuse)
+                sigs[changed] = minhash_signatures([contents[i] for i in changed])
+                self.ids, self.crcs, self.sigs = ids, crcs, sigs
+                self.keys = lsh_band_keys(sigs)
+                self._clusters = {}
+                self._save()
+            self.stamp = stamp
+            return self
+
+    def apply_changes(self, changes):
+        """Cập nhật chữ ký theo bộ thay đổi vừa ghi vào file, không quét lại cả bảng"""
+        with self.lock:
+            if self.stamp is None:
+                return
+            rows = {**changes["update"], **changes["insert"]}
+            touched = np.array(sorted(set(rows) | set(changes["delete"])), dtype=np.int64)
+            keep = ~np.isin(self.ids, touched)
+            new_ids = np.array(sorted(rows), dtype=np.int64)
+            contents = [rows[i].get("content") or "" for i in new_ids.tolist()]
+            ids = np.concatenate([self.ids[keep], new_ids])
+            order = np.argsort(ids, kind="stable")
+            self.ids = ids[order]
+            self.crcs = np.concatenate([
+                self.crcs[keep],
+                np.fromiter((zlib.crc32(c.encode("utf-8")) for c in contents), dtype=np.uint32, count=len(contents))
+            ])[order]
+            self.sigs = np.concatenate([self.sigs[keep], minhash_signatures(contents)])[order]
+            self.keys = lsh_band_keys(self.sigs)
+            self._clusters = {}
+            # File chữ ký trên đĩa được ghi lại ở lần refresh() sau (so theo crc32)
+            self.stamp = self._file_stamp()
+
+    def _save(self):
+        path = near_dup_path(self.db_path)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, ids=self.ids, crcs=self.crcs, sigs=self.sigs)
+        os.replace(tmp_path, path)
+
+    @perf_timed("near_dup.clusters")
+    def clusters(self, threshold=NEAR_DUP_THRESHOLD):
+        """Các nhóm id gần trùng: ứng viên lấy từ cùng bucket LSH, giữ cặp có Jaccard ước lượng >= threshold"""
+        if threshold in self._clusters:
+            return self._clusters[threshold]
+        left, right = [], []
+        for band in range(NEAR_DUP_BANDS):
+            order = np.argsort(self.keys[:, band], kind="stable")
+            sorted_keys = self.keys[order, band]
+            same = np.flatnonzero(sorted_keys[1:] == sorted_keys[:-1])
+            left.append(order[same])
+            right.append(order[same + 1])
+        left = np.concatenate(left) if left else np.zeros(0, dtype=np.int64)
+        right = np.concatenate(right) if right else np.zeros(0, dtype=np.int64)
+        pairs = np.unique(np.stack([np.minimum(left, right), np.maximum(left, right)], axis=1), axis=0)
+        if len(pairs):
+            similarity = (self.sigs[pairs[:, 0]] == self.sigs[pairs[:, 1]]).mean(axis=1)
+            pairs = pairs[similarity >= threshold]
+
+        parent = {}
+
+        def find(x):
+            root = x
+            while parent.get(root, root) != root:
+                root = parent[root]
+            while parent.get(x, x) != root:
+                parent[x], x = root, parent[x]
+            return root
+
+        for a, b in pairs.tolist():
+            ra, rb = find(a), find(b)
+            if ra != rb:
+                parent[max(ra, rb)] = min(ra, rb)
+        members = {}
+        for pos in set(parent) | set(parent.values()):
+            members.setdefault(find(pos), []).append(pos)
+        result = sorted(
+            ([int(self.ids[p]) for p in sorted(group)] for group in members.values()),
+            key=lambda g: (-len(g), g[0])
+        )
+        self._clusters[threshold] = result
+        return result
+
+    def lookup(self, text, threshold=NEAR_DUP_THRESHOLD, limit=10):
+        """Kiểm tra trước khi thêm: [(id, độ giống)] của các quote gần trùng với text"""
+        sig = minhash_signatures([text])
+        candidates = np.flatnonzero((self.keys == lsh_band_keys(sig)[0]).any(axis=1))
+        similarity = (self.sigs[candidates] == sig[0]).mean(axis=1)
+        order = np.argsort(-similarity, kind="stable")
+        return [
+            (int(self.ids[candidates[i]]), float(similarity[i]))
+            for i in order[:limit] if similarity[i] >= threshold
+        ]
+
+
+@st.cache_resource(show_spinner=False, max_entries=NEAR_DUP_MAX_INDEXES)
+def get_near_dup_index(db_path):
+    return NearDuplicateIndex(db_path)
+
+
+# === Hàng đợi tải lên nền (write-behind) ===
+
+UPLOAD_COALESCE_SECONDS = float(os.environ.get("QUOTE_UPLOAD_DELAY_SECONDS", "3"))
+UPLOAD_MAX_ATTEMPTS = 5
+UPLOAD_WORKERS = 2
+
+
+@perf_timed("sqlite.snapshot")
+def snapshot_db(db_path):
+    """Chụp một bản nhất quán của file SQLite để tải lên trong lúc file vẫn được ghi.
+
+    Dùng VACUUM INTO để bản chụp không mang theo các trang trống do sửa/xoá để lại. Bản chụp
+    không có đuôi .db để evict_cache không coi nó là một file trong cache."""
+    fd, snapshot_path = tempfile.mkstemp(suffix=".snapshot", dir=os.path.dirname(db_path))
+    os.close(fd)
+    os.remove(snapshot_path)  # VACUUM INTO cần file đích chưa tồn tại
+    src = sqlite3.connect(db_path)
+    try:
+        src.execute("VACUUM INTO ?", (snapshot_path,))
+    except sqlite3.OperationalError:
+        # SQLite cũ (< 3.27) không có VACUUM INTO: chép nguyên trang bằng backup API
+        dst = sqlite3.connect(snapshot_path)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+    finally:
+        src.close()
+    return snapshot_path
+
+
+class UploadQueue:
+    """Tải file DB lên Drive ở luồng nền, gộp các lần lưu liên tiếp của cùng một file.
+
+    Mỗi lần submit() đặt (hoặc dời) hạn tải lên của file thêm `delay` giây,
+    nên một loạt chỉnh sửa liền nhau chỉ sinh ra một lần upload. Mỗi file chỉ
+    có tối đa một upload đang chạy; lỗi được thử lại với backoff.
+    """
+
+    def __init__(self, upload, delay=UPLOAD_COALESCE_SECONDS, workers=UPLOAD_WORKERS):
+        self.upload = upload
+        self.delay = delay
+        self.cond = threading.Condition()
+        self.jobs = {}
+        self.in_flight = set()
+        self.status = {}
+        self.stopping = False
+        self.slots = threading.BoundedSemaphore(workers)
+        # Không phải daemon (kể cả khi tạo từ luồng script của Streamlit): khi tiến trình thoát,
+        # luồng này còn tải nốt các file đang chờ
+        self.scheduler = threading.Thread(target=self._schedule, name="drive-upload-scheduler", daemon=False)
+        self.scheduler.start()
+        atexit.register(self.shutdown)
+
+    def submit(self, file_id, db_path, delay=None):
+        with self.cond:
+            job = self.jobs.get(file_id)
+            self.jobs[file_id] = {
+                "path": db_path,
+                "due": time.monotonic() + (self.delay if delay is None else delay),
+                "attempt": 0,
+                "saves": (job["saves"] if job else 0) + 1,
+            }
+            status = self.status.setdefault(file_id, {"last_success": None, "error": None})
+            status["pending"] = self.jobs[file_id]["saves"]
+            self.cond.notify_all()
+
+    def status_of(self, file_id):
+        with self.cond:
+            status = dict(self.status.get(file_id, {}))
+            status["in_flight"] = file_id in self.in_flight
+            status.setdefault("pending", 0)
+            return status
+
+    def has_pending(self, file_id):
+        with self.cond:
+            return file_id in self.jobs or file_id in self.in_flight
+
+    def _schedule(self):
+        while True:
+            with self.cond:
+                while True:
+                    if not threading.main_thread().is_alive():
+                        self.stopping = True
+                    now = time.monotonic()
+                    ready = [
+                        fid for fid, job in self.jobs.items()
+                        if fid not in self.in_flight and (job["due"] <= now or self.stopping)
+                    ]
+                    if ready or (self.stopping and not self.jobs and not self.in_flight):
+                        break
+                    waiting = [job["due"] for fid, job in self.jobs.items() if fid not in self.in_flight]
+                    self.cond.wait(min(max(min(waiting) - now, 0.05), 1.0) if waiting else 1.0)
+                if not ready:
+                    return
+                for fid in ready:
+                    job = self.jobs.pop(fid)
+                    self.in_flight.add(fid)
+                    self.status[fid]["pending"] = 0
+                    threading.Thread(target=self._run_job, args=(fid, job), name=f"drive-upload-{fid}", daemon=False).start()
+
+    def _run_job(self, file_id, job):
+        self.slots.acquire()
         try:
-            update_db_and_upload(selected_db_file["id"], df_to_save)
-            st.sidebar.success("✅ Đã cập nhật database và tải lên Drive thành công.")
+            snapshot_path = snapshot_db(job["path"])
+            try:
+                result = self.upload(file_id, snapshot_path)
+            finally:
+                os.remove(snapshot_path)
         except Exception as e:
-            st.sidebar.error(f"❌ Lỗi khi tải lên Drive: {e}")
-    else:
-        st.sidebar.warning("⚠️ Database trống, không có gì để cập nhật.")
+            with self.cond:
+                self.status[file_id]["error"] = f"{e} (lần thử {job['attempt'] + 1})"
+                # Lần lưu mới hơn (nếu có) đã bao gồm dữ liệu của job này
+                if file_id not in self.jobs and job["attempt"] + 1 < UPLOAD_MAX_ATTEMPTS:
+                    job["attempt"] += 1
+                    job["due"] = time.monotonic() + (0 if self.stopping else min(2 ** job["attempt"], 60))
+                    self.jobs[file_id] = job
+                    self.status[file_id]["pending"] = job["saves"]
+        else:
+            with self.cond:
+                self.status[file_id].update(last_success=time.time(), error=None)
+                newer_pending = file_id in self.jobs
+            if job["path"] == cache_paths(file_id)[0]:
+                if newer_pending:
+                    # Lần lưu mới hơn còn chờ có thể đã đổi encoding (set_db_encoding): giữ lựa chọn đó
+                    result = {**result, "appProperties": None, "encoding": cached_encoding(file_id)}
+                write_cache_meta(file_id, result, dirty=newer_pending)
+        finally:
+            self.slots.release()
+            with self.cond:
+                self.in_flight.discard(file_id)
+                self.cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Tải lên ngay mọi file đang chờ và đợi tới khi xong"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            for job in self.jobs.values():
+                job["due"] = 0
+            self.cond.notify_all()
+            while self.jobs or self.in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+        return True
+
+    def shutdown(self):
+        with self.cond:
+            if self.stopping:
+                return
+            self.stopping = True
+            self.cond.notify_all()
+        if self.scheduler is not threading.current_thread():
+            self.scheduler.join()
+
+
+def _upload_in_background(file_id, path):
+    return upload_db_file(path, file_id, fields=REMOTE_META_FIELDS)
+
+
+@st.cache_resource(show_spinner=False)
+def get_upload_queue():
+    return UploadQueue(_upload_in_background)
+
+
+@st.fragment(run_every=2)
+def sync_status_panel(file_id):
+    status = get_upload_queue().status_of(file_id)
+    if status["in_flight"]:
+        st.info("⏫ Đang tải database lên Drive...")
+    if status["pending"]:
+        st.warning(f"🕓 Chờ tải lên Drive (gộp {status['pending']} lần lưu).")
+    if status.get("error"):
+        st.error(f"❌ Lỗi tải lên: {status['error']}")
+    if status.get("last_success"):
+        st.caption(f"✅ Đồng bộ lần cuối lúc {time.strftime('%H:%M:%S', time.localtime(status['last_success']))}")
+
+
+def sync_local_db(file_id, db_path, delay=None):
+    """Đưa file vào hàng đợi tải lên nền thay vì upload ngay trong lượt chạy script"""
+    get_upload_queue().submit(file_id, db_path, delay=delay)
+    st.session_state["unsynced_changes"] = 0
+
+@perf_timed("update_reload")
+def update_reload():
+    """Ghi các thay đổi đang chờ vào bản sao cục bộ; trả về tập id sửa không lưu được vì dòng đã mất"""
+    global selected_db_file
+    db_path = st.session_state.get("local_db_path")
+    if db_path is None:
+        st.sidebar.warning("⚠️ Chưa nạp database, không có gì để cập nhật.")
+        return set()
+    missing = set()
+    try:
+        # Chỉ ghi những dòng đã thay đổi vào bản sao cục bộ
+        changes = st.session_state.get("pending_changes") or new_change_set()
+        applied, new_ids, missing = apply_changes(db_path, changes)
+        if missing:
+            # Dòng đã bị phiên khác xoá/chuyển đi: bỏ khỏi lớp phủ chỉ mục tag thay vì thêm lại
+            get_tag_index(db_path).delete(missing)
+            for quote_id in missing:
+                del changes["update"][quote_id]
+            st.sidebar.warning(
+                f"⚠️ {len(missing)} quote không còn trong database (có thể vừa bị xoá hoặc chuyển đi), "
+                f"không lưu được: id {', '.join(map(str, sorted(missing)))}."
+            )
+        if new_ids:
+            # Đổi id tạm của các dòng vừa thêm sang id thật do SQLite cấp
+            tag_index = get_tag_index(db_path)
+            for temp_id, quote_id in new_ids.items():
+                tag_index.rekey(temp_id, quote_id)
+            changes["insert"] = {new_ids[i]: {**row, "id": new_ids[i]} for i, row in changes["insert"].items()}
+        if applied:
+            get_near_dup_index(db_path).apply_changes(changes)
+        st.session_state["pending_changes"] = new_change_set()
+        st.session_state["unsynced_changes"] = st.session_state.get("unsynced_changes", 0) + applied
+        if applied:
+            mark_cache_dirty(selected_db_file["id"])
+        if not st.session_state["unsynced_changes"]:
+            st.sidebar.info("ℹ️ Không có thay đổi nào cần cập nhật.")
+        elif st.session_state.get("auto_upload", True):
+            sync_local_db(selected_db_file["id"], db_path)
+            st.sidebar.success("✅ Đã lưu thay đổi, database sẽ được tải lên Drive ở nền.")
+        else:
+            st.sidebar.info(
+                f"💾 Đã lưu {st.session_state['unsynced_changes']} thay đổi vào bản sao cục bộ, chưa tải lên Drive."
+            )
+    except Exception as e:
+        st.sidebar.error(f"❌ Lỗi khi tải lên Drive: {e}")
+    return missing
+@perf_timed("transfer_quotes")
+def transfer_quotes(db_path, ids, target_files, move=False):
+    """Copy (hoặc Move) các quote đã chọn sang một hay nhiều database khác.
+
+    Mỗi file đích được ghi trong một lượt trên bản cache cục bộ rồi đưa vào hàng đợi
+    tải lên, các file đích được tải lên song song. Move chỉ xoá khỏi nguồn khi mọi
+    file đích đã chép xong."""
+    queue = get_upload_queue()
+    copied = {}
+    for target in target_files:
+        # File nguồn đã được ghim theo phiên; file đích ghim tới khi đã đánh dấu dirty
+        with get_cache_pins().hold(target["id"]):
+            target_path = fetch_db_file(target["id"], progress=progress_bar(f"⬇️ Đang tải `{target['name']}`"))
+            copied[target["name"]] = copy_quotes_between(db_path, target_path, ids)
+            mark_cache_dirty(target["id"])
+        queue.submit(target["id"], target_path, delay=0)
+    if move:
+        for quote_id in ids:
+            record_change("delete", quote_id)
+        get_tag_index(db_path).delete(ids)
+        update_reload()
+    return copied
+
+
+def bulk_import(db_path, uploaded, dedupe=True):
+    """Nhập cả file CSV/JSONL tải lên vào bản sao cục bộ rồi tải lên Drive một lần"""
+    fmt = import_format(uploaded.name)
+    if fmt is None:
+        raise ValueError("Chỉ hỗ trợ file .csv, .jsonl hoặc .ndjson")
+    status = st.empty()
+    text = io.TextIOWrapper(uploaded, encoding="utf-8-sig", newline="")
+    try:
+        stats = import_quotes(
+            db_path, read_import_rows(text, fmt), dedupe=dedupe,
+            progress=lambda s: status.caption(f"📥 Đã thêm {s['inserted']} quote...")
+        )
+    finally:
+        text.detach()
+    status.empty()
+    if stats["inserted"]:
+        # Ghi thẳng vào file nên dựng lại chỉ mục tag thay vì cập nhật lớp phủ từng dòng
+        st.session_state.pop("tag_index", None)
+        mark_cache_dirty(selected_db_file["id"])
+        sync_local_db(selected_db_file["id"], db_path, delay=0)
+    return stats
+
+
+def folder_search_ui(db_files):
+    with st.form("folder_search_form"):
+        text = st.text_input("🌐 Tìm quote theo nội dung hoặc tag trong mọi database của thư mục:")
+        submitted = st.form_submit_button("🔍 Tìm")
+    if submitted and text.strip():
+        progress = st.progress(0.0, text=f"Đang tìm trong {len(db_files)} database...")
+        table = st.empty()
+        results, errors = [], []
+        with perf_span("folder_search", files=len(db_files)) as span:
+            for done, (db_file, rows, error) in enumerate(search_folder(db_files, text), 1):
+                if error is not None:
+                    errors.append((db_file["name"], str(error)))
+                results.extend({"database": db_file["name"], **row} for row in rows)
+                progress.progress(done / len(db_files), text=f"Đã tìm {done}/{len(db_files)} database")
+                if rows:
+                    table.dataframe(results, use_container_width=True, hide_index=True)
+            span["rows"] = len(results)
+        progress.empty()
+        table.empty()
+        st.session_state["folder_search"] = {"text": text, "results": results, "errors": errors}
+
+    last = st.session_state.get("folder_search")
+    if last:
+        hit_files = len({row["database"] for row in last["results"]})
+        st.caption(f"“{last['text']}”: {len(last['results'])} quote trong {hit_files} database.")
+        if last["results"]:
+            st.dataframe(last["results"], use_container_width=True, hide_index=True)
+        for name, error in last["errors"]:
+            st.warning(f"⚠️ Không tìm được trong `{name}`: {error}")
+
+
 # === Giao diện chính ===
 
 def main_ui():
+    import pandas as pd
+    db_path = st.session_state["local_db_path"]
     with tab4:
-        df = st.session_state.get("quotes_df")
-        if df is None or df.empty:
+        tag_index = get_tag_index(db_path)
+        if tag_index.size == 0:
             st.info("Chưa có quote nào trong database.")
         else:
-            all_tags = sorted(set(tag for tags in df["tag"].dropna() for tag in tags.split(" ")))
-            try:
-                all_tags.remove("")
-            except:
-                pass
+            all_tags = tag_index.tags()
 
             with st.sidebar:
                 st.markdown("🎛️ **Bộ lọc Tag Random**")
@@ -239,19 +2455,15 @@ def main_ui():
                     default=all_tags,  # Mặc định loại bỏ toàn bộ tag
                     key="exclude_tags"
                 )
-            def quote_filter(row):
-                tags = set(row["tag"].split()) if pd.notna(row["tag"]) else set()
-                include_ok = not included_tags or any(tag in tags for tag in included_tags)
-                exclude_ok = not any(tag in tags for tag in excluded_tags)
-                return include_ok and exclude_ok
-
-            filtered_df = df[df.apply(quote_filter, axis=1)]
+                fewer_pending = st.checkbox("🐢 Ít gặp quote #pending hơn", key="fewer_pending")
+            sampler = get_quote_sampler(
+                db_path, included_tags, excluded_tags, {"#pending": PENDING_WEIGHT} if fewer_pending else None
+            )
 
-            quote = None
-            if not filtered_df.empty:
-                quote = filtered_df.sample(1).iloc[0]
+            quote = sampled_quote(db_path, sampler)
+            if quote is not None:
                 dau = f"({quote['date']})" if quote['date'] else ""
-                content_md = quote['content'].replace('\n', '<br>')
+                content_md = (quote['content'] or "").replace('\n', '<br>')
                 st.markdown(f"""
                 {quote['link']}
                 <div style='font-size: 22px; line-height: 1.6; font-weight: bold;'>
@@ -269,151 +2481,219 @@ def main_ui():
             col2, col1 = st.columns(2)
 
             with col1:
-                if st.button("🎲 Quote khác"):
-                    pass
+                # Bốc trong callback để quote mới hiện ngay ở lượt chạy kế tiếp
+                st.button("🎲 Quote khác", on_click=sampler.draw)
+                st.caption(f"Còn {sampler.remaining()} quote chưa hiện trong vòng này.")
 
             with col2:
-                if st.button("📝 Pending"):
-                    quote_id = quote["id"]
-                    df.loc[df["id"] == quote_id, "tag"] = df.loc[df["id"] == quote_id, "tag"].apply(
-                        lambda t: "#pending" if pd.isna(t) else t if "#pending" in t else f"{t} #pending"
-                    )
-                    st.session_state["quotes_df"] = df
-                    st.success("✅ Đã gắn tag #pending cho quote này.")
+                if st.button("📝 Pending") and quote is not None:
+                    t = quote["tag"]
+                    quote["tag"] = "#pending" if not t else t if "#pending" in t else f"{t} #pending"
+                    tag_index.update(quote)
+                    record_change("update", quote["id"], quote)
+                    if quote["id"] in update_reload():
+                        st.error("❌ Quote này không còn trong database, không gắn tag được.")
+                    else:
+                        st.success("✅ Đã gắn tag #pending cho quote này.")
     with tab1:
         st.subheader("➕ Thêm quote mới")
 
         with st.form("add_quote_form"):
             content, speaker, note, date, tag, link = quote_input_form()
 
-            submitted = st.form_submit_button("✅ Thêm quote")
+            col_submit, col_check = st.columns(2)
+            submitted = col_submit.form_submit_button("✅ Thêm quote")
+            check_duplicates = col_check.form_submit_button("🔎 Kiểm tra trùng trước khi thêm")
+            if check_duplicates and content.strip():
+                matches = get_near_dup_index(db_path).refresh().lookup(content)
+                if matches:
+                    similarity = dict(matches)
+                    st.warning(f"⚠️ Có {len(matches)} quote gần trùng:")
+                    for row in fetch_quotes_by_ids(db_path, [i for i, _ in matches], LIST_COLUMNS):
+                        st.markdown(f"- `{similarity[row['id']]:.0%}` {quote_label(row)}")
+                else:
+                    st.success("✅ Không thấy quote nào gần trùng.")
             if submitted:
-                if not any([content, speaker, note, date, tag, link]):
+                new_row = clean_quote_row(
+                    {"content": content, "speaker": speaker, "note": note, "date": date, "tag": tag, "link": link}
+                )
+                if new_row is None:
                     st.warning("⚠️ Ít nhất phải có một trường được điền.")
                 else:
-                    cleaned_content = content.strip().strip('"').replace('"', "'")
-                    df = st.session_state["quotes_df"]
-                    new_id = int(df["id"].max() + 1) if not df.empty else 1
-                    new_row = {
-                        "id": new_id,
-                        "content": f'"{cleaned_content}"',
-                        "speaker": speaker.strip(),
-                        "note": note.strip(),
-                        "date": date.strip(),
-                        "tag": tag.strip(),
-                        "link": link.strip()
-                    }
-                    st.session_state["quotes_df"] = pd.concat(
-                        [st.session_state["quotes_df"], pd.DataFrame([new_row])],
-                        ignore_index=True
-                    )
+                    # id tạm để sửa/xoá trong bộ nhớ tạm; id thật do SQLite cấp khi ghi vào file
+                    new_id = temp_quote_id()
+                    new_row = {"id": new_id, **new_row}
+                    record_change("insert", new_id, new_row)
+                    get_tag_index(db_path).add(new_row)
                     st.success("✅ Đã thêm quote mới vào bộ nhớ tạm.")
                     update_reload()
 
+        with st.expander("📦 Nhập / xuất hàng loạt (CSV, JSONL)"):
+            st.caption("Cột nhận: " + ", ".join(QUOTE_COLUMNS[1:]) + ". Cột `id` bị bỏ qua, id mới được cấp tự động.")
+            uploaded = st.file_uploader("📥 Chọn file để nhập", type=["csv", "jsonl", "ndjson"], key="bulk_import_file")
+            dedupe = st.checkbox("Bỏ qua quote trùng nội dung", value=True, key="bulk_import_dedupe")
+            if st.button("📥 Nhập vào database", disabled=uploaded is None):
+                try:
+                    stats = bulk_import(db_path, uploaded, dedupe=dedupe)
+                    st.success(
+                        f"✅ Đã thêm {stats['inserted']} quote, bỏ qua {stats['duplicates']} quote trùng "
+                        f"và {stats['empty']} dòng rỗng."
+                    )
+                except (ValueError, UnicodeDecodeError, csv.Error) as e:
+                    st.error(f"❌ Không nhập được file: {e}")
+
+            export_fmt = st.radio("Định dạng xuất", ["csv", "jsonl"], horizontal=True, key="bulk_export_format")
+            if st.button("📤 Chuẩn bị file xuất"):
+                discard_export()
+                # Ghi ra thư mục tạm của hệ thống, không lẫn vào cache database (tính dung lượng, dọn cache)
+                fd, export_path = tempfile.mkstemp(prefix="quote_export_", suffix=f".{export_fmt}")
+                with open(fd, "w", encoding="utf-8", newline="") as fh:
+                    count = export_quotes(db_path, fh, export_fmt)
+                st.session_state["bulk_export"] = (export_path, export_fmt, count)
+            if st.session_state.get("bulk_export"):
+                export_path, export_fmt, count = st.session_state["bulk_export"]
+                if os.path.exists(export_path):
+                    base = os.path.splitext(selected_db_file["name"])[0]
+                    with open(export_path, "rb") as fh:
+                        st.download_button(
+                            f"⬇️ Tải {count} quote ({export_fmt.upper()})", fh,
+                            file_name=f"{base}.{export_fmt}",
+                            mime="text/csv" if export_fmt == "csv" else "application/x-ndjson",
+                            on_click=discard_export
+                        )
+
     with tab2:
         with st.expander("📋 Danh sách toàn bộ quote"):
-            df = get_all_quotes()
-            if df.empty:
+            if count_quotes(db_path) == 0:
                 st.info("Chưa có quote nào.")
             else:
-                df["normalized_content"] = df["content"].str.strip().str.lower()
-                st.dataframe(df.drop(columns=["normalized_content"]), use_container_width=True)
+                rows = page_table("list_all", db_path, QUOTE_COLUMNS)
+                with perf_span("pandas.dataframe", rows=len(rows)):
+                    table = pd.DataFrame(rows, columns=QUOTE_COLUMNS)
+                st.dataframe(table, use_container_width=True)
 
                 st.markdown("### 🔁 Các quote bị trùng nội dung")
-                duplicates = df[df.duplicated("normalized_content", keep=False)].sort_values("normalized_content")
-                if not duplicates.empty:
-                    st.dataframe(duplicates.drop(columns=["normalized_content"]), use_container_width=True)
+                threshold = st.slider("Độ giống tối thiểu", 0.3, 1.0, NEAR_DUP_THRESHOLD, 0.05, key="near_dup_threshold")
+                clusters = get_near_dup_index(db_path).refresh().clusters(threshold)
+                if clusters:
+                    shown = clusters[:100]
+                    rows = fetch_quotes_by_ids(db_path, [i for group in shown for i in group])
+                    group_of = {i: n for n, group in enumerate(shown, 1) for i in group}
+                    with perf_span("pandas.dataframe", rows=len(rows)):
+                        duplicates = pd.DataFrame(rows, columns=QUOTE_COLUMNS)
+                        duplicates.insert(0, "nhóm", duplicates["id"].map(group_of))
+                    st.caption(f"{len(clusters)} nhóm quote gần trùng (hiện {len(shown)} nhóm lớn nhất).")
+                    st.dataframe(duplicates, use_container_width=True, hide_index=True)
                 else:
                     st.info("✅ Không có quote nào bị trùng.")
 
         st.markdown("### 🔍 Tìm và sửa quote")
         search_text = st.text_input("Tìm quote theo nội dung hoặc tag:")
-        filtered_df = df[
-            df["content"].str.contains(search_text, case=False, na=False) |
-            df["tag"].str.contains(search_text, case=False, na=False)
-        ]
+        if search_text.strip():
+            matched_ids = search_quote_ids(db_path, search_text)
+            total = count_search_matches(db_path, search_text) if len(matched_ids) >= SEARCH_LIMIT else None
+            page_rows = fetch_quotes_by_ids(db_path, page_ids("edit_search", matched_ids, total), LIST_COLUMNS)
+        else:
+            page_rows = page_table("edit_all", db_path)
 
-        if not filtered_df.empty:
-            # Tạo mapping label -> index (vị trí dòng trong df)
-            quote_options = {
-                f"{idx} | {row['content'][:50]}...": idx
-                for idx, row in filtered_df.iterrows()
-            }
+        if page_rows:
+            # Tạo mapping label -> id
+            quote_options = {quote_label(row): row["id"] for row in page_rows}
             selected_label = st.selectbox("Chọn quote để sửa:", list(quote_options.keys()))
-            selected_index = quote_options[selected_label]
-            selected_row = df.iloc[selected_index]
+            selected_id = quote_options[selected_label]
+            selected_row = fetch_quote(db_path, selected_id)
 
-            with st.expander(f"✏️ Sửa Quote tại index {selected_index}"):
+            with st.expander(f"✏️ Sửa Quote ID {selected_id}"):
                 with st.form("edit_selected_quote"):
                     new_content, new_speaker, new_note, new_date, new_tag, new_link = quote_edit_form(selected_row)
                     submit_edit = st.form_submit_button("💾 Lưu thay đổi")
 
                     if submit_edit:
-                        st.session_state["quotes_df"].at[selected_index, "content"] = new_content
-                        st.session_state["quotes_df"].at[selected_index, "speaker"] = new_speaker
-                        st.session_state["quotes_df"].at[selected_index, "note"] = new_note
-                        st.session_state["quotes_df"].at[selected_index, "date"] = new_date
-                        st.session_state["quotes_df"].at[selected_index, "tag"] = new_tag
-                        st.session_state["quotes_df"].at[selected_index, "link"] = new_link
-                        st.success("✅ Đã cập nhật quote.")
-                        update_reload()
+                        edited_row = {
+                            "id": selected_id,
+                            "content": new_content,
+                            "speaker": new_speaker,
+                            "note": new_note,
+                            "date": new_date,
+                            "tag": new_tag,
+                            "link": new_link
+                        }
+                        record_change("update", selected_id, edited_row)
+                        get_tag_index(db_path).update(edited_row)
+                        if selected_id in update_reload():
+                            st.error("❌ Quote này không còn trong database (có thể vừa bị xoá hoặc chuyển đi).")
+                        else:
+                            st.success("✅ Đã cập nhật quote.")
         else:
             st.info("Không tìm thấy quote nào khớp.")
 
     with tab3:
         st.markdown("### 🎯 Chọn database mục tiêu để Copy/Move")
-        target_db_name = st.selectbox(
-            "🗃️ Chọn database khác để sao chép/di chuyển (ngoại trừ file hiện tại):",
+        target_db_names = st.multiselect(
+            "🗃️ Chọn các database khác để sao chép/di chuyển (ngoại trừ file hiện tại):",
             [f["name"] for f in db_files if f["id"] != selected_db_file["id"]]
         )
-        target_db_file = next((f for f in db_files if f["name"] == target_db_name), None)
+        target_db_files = [f for f in db_files if f["name"] in target_db_names]
         st.subheader("🗑️ Xóa nhiều quote")
-        df = get_all_quotes()
 
-        if df.empty:
+        if count_quotes(db_path) == 0:
             st.info("Chưa có quote nào để xóa.")
         else:
             search_text = st.text_input("🔍 Tìm quote theo nội dung hoặc tag để lọc:")
-            filtered_df = df[
-                df["content"].str.contains(search_text, case=False, na=False) |
-                df["tag"].str.contains(search_text, case=False, na=False)
-            ] if search_text else df
+            if search_text.strip():
+                matched_ids = search_quote_ids(db_path, search_text)
+                total = count_search_matches(db_path, search_text) if len(matched_ids) >= SEARCH_LIMIT else None
+                page_rows = fetch_quotes_by_ids(db_path, page_ids("delete_search", matched_ids, total), LIST_COLUMNS)
+            else:
+                matched_ids = None
+                page_rows = page_table("delete_all", db_path)
 
-            if not filtered_df.empty:
-                # Dùng index của filtered_df làm key chọn
-                options = [f"{idx} | {row['content'][:50]}..." for idx, row in filtered_df.iterrows()]
+            if page_rows:
+                options = [quote_label(row) for row in page_rows]
 
-                select_all = st.checkbox("✅ Chọn tất cả")
+                select_all = st.checkbox("✅ Chọn tất cả (mọi trang)")
 
                 selected = st.multiselect(
                     "Chọn quote để xóa:",
                     options,
-                    default=options if select_all else []
+                    default=[],
+                    disabled=select_all
                 )
 
-                # Lấy index thay vì id
-                selected_ids = [int(s.split("|")[0].strip()) for s in selected]
-
-
+                if select_all:
+                    # Kết quả tìm kiếm ở trên bị cắt ở SEARCH_LIMIT; chọn tất cả phải lấy mọi id khớp
+                    selected_ids = search_all_quote_ids(db_path, search_text) if matched_ids is not None \
+                        else fetch_all_ids(db_path)
+                else:
+                    selected_ids = [int(s.split("|")[0].strip()) for s in selected]
 
                 if selected_ids:
                     st.warning(f"🔔 Bạn đã chọn {len(selected_ids)} quote.")
 
                     col_copy, col_move, col_delete = st.columns(3)
-                # selected_ids là list index (int)
-                
-                    if col_copy.button("📄 Copy sang database khác"):
-                        if target_db_file:
-                            target_df = load_quotes_from_drive(target_db_file["id"])
-                            # Lấy rows theo index
-                            rows_to_copy = df.iloc[selected_ids].copy()
-                            rows_to_copy["id"] = target_df["id"].max() + 1 if not target_df.empty else 1
-                            target_df = pd.concat([target_df, rows_to_copy], ignore_index=True)
-                            update_db_and_upload(target_db_file["id"], target_df)
-                            st.success(f"✅ Đã copy {len(rows_to_copy)} quote sang `{target_db_file['name']}`.")
+
+                    for column, label, move in (
+                        (col_copy, "📄 Copy sang database khác", False),
+                        (col_move, "🚚 Move sang database khác", True),
+                    ):
+                        if not column.button(label):
+                            continue
+                        if not target_db_files:
+                            st.warning("⚠️ Vui lòng chọn ít nhất một database mục tiêu.")
+                            continue
+                        try:
+                            copied = transfer_quotes(db_path, selected_ids, target_db_files, move=move)
+                        except Exception as e:
+                            st.error(f"❌ Lỗi khi chuyển quote: {e}")
+                            continue
+                        action = "chuyển" if move else "copy"
+                        for name, n in copied.items():
+                            st.success(f"✅ Đã {action} {n} quote sang `{name}`.")
 
                     if col_delete.button("❌ Xác nhận xóa"):
-                        st.session_state["quotes_df"] = df.drop(index=selected_ids).reset_index(drop=True)
+                        for quote_id in selected_ids:
+                            record_change("delete", quote_id)
+                        get_tag_index(db_path).delete(selected_ids)
                         st.success(f"✅ Đã xóa {len(selected_ids)} quote.")
                         update_reload()
 
@@ -422,75 +2702,133 @@ def main_ui():
 
 # === Sidebar chọn DB ===
 
-st.sidebar.title("⚙️ Cài đặt Database")
-folder_url = st.sidebar.text_input("📂 Nhập link thư mục Google Drive chứa DB:")
-folder_id = extract_folder_id(folder_url) if folder_url else None
-selected_db_file = None
-new_file_name = truncate_at_special_chars(st.sidebar.text_input("Nhập tên file database cần tạo hoặc xóa"))
-
+# Streamlit chạy script với __name__ == "__main__"; import SQL_Card (ví dụ từ benchmark.py) chỉ lấy các hàm
+if __name__ == "__main__":
+    perf_begin_run()
+    st.sidebar.title("⚙️ Cài đặt Database")
+    folder_url = st.sidebar.text_input("📂 Nhập link thư mục Google Drive chứa DB:")
+    folder_id = extract_folder_id(folder_url) if folder_url else None
+    selected_db_file = None
+    db_files = []
+    new_file_input = st.sidebar.text_input("Nhập tên file database cần tạo hoặc xóa (nhiều file cách nhau bằng dấu phẩy)")
+    new_file_names = list(dict.fromkeys(
+        truncate_at_special_chars(name.strip()) for name in ([n for n in new_file_input.split(",") if n.strip()] or [""])
+    ))
+
+
+    if st.sidebar.button("➕ Tạo file database rỗng"):
+        if folder_id:
+            created, failed = create_empty_db_files(folder_id, new_file_names)
+            for new_file in created:
+                st.sidebar.success(f"Đã tạo file: `{new_file['name']}` (ID: {new_file['id']})")
+            for name in failed:
+                st.sidebar.error(f"❌ Không thể tạo: `{name}`")
+        else:
+            st.sidebar.warning("Vui lòng nhập link thư mục trước.")
+
+    if st.sidebar.button("🗑️ Xoá file database"):
+        if folder_id:
+            deleted, failed = delete_db_files(folder_id, new_file_names)
+            for name in deleted:
+                st.sidebar.success(f"✅ Đã xoá file: `{name}`")
+            for name in failed:
+                st.sidebar.error(f"❌ Không tìm thấy hoặc không thể xoá: `{name}`")
+        else:
+            st.sidebar.warning("⚠️ Vui lòng nhập link thư mục trước.")
 
-if st.sidebar.button("➕ Tạo file database rỗng"):
-    if folder_id:
-        new_file = create_empty_db_file(folder_id, new_file_name)
-        st.sidebar.success(f"Đã tạo file: `{new_file['name']}` (ID: {new_file['id']})")
-    else:
-        st.sidebar.warning("Vui lòng nhập link thư mục trước.")
 
-if st.sidebar.button("🗑️ Xoá file database"):
     if folder_id:
-        success = delete_db_file(folder_id, new_file_name)
-        if success:
-            st.sidebar.success(f"✅ Đã xoá file: `{new_file_name}`")
-        else:
-            st.sidebar.error(f"❌ Không tìm thấy hoặc không thể xoá: `{new_file_name}`")
+        try:
+            db_files = get_folder_listing(folder_id).files(force=st.sidebar.button("🔄 Làm mới danh sách file"))
+            if db_files:
+                file_names = [f["name"] for f in db_files]
+                selected_name = st.sidebar.selectbox("🗃️ Chọn database:", file_names)
+                selected_db_file = next(f for f in db_files if f["name"] == selected_name)
+                st.sidebar.checkbox("⚡ Tự động tải lên Drive sau mỗi thay đổi", value=True, key="auto_upload")
+            else:
+                st.sidebar.warning("❗ Không tìm thấy file .db trong thư mục.")
+        except Exception as e:
+            st.sidebar.error(f"Lỗi khi truy cập Drive: {e}")
+    st.title("📚 Quote Database Manager")
+
+    tab4, tab1, tab2, tab3, tab5 = st.tabs([
+        "🎲 Random Quote",
+        "➕ Thêm Quote", 
+        "✏️ Sửa Quote", 
+        "🗑️ Xóa Quote",
+        "🌐 Tìm mọi DB"
+    ])
+
+    if selected_db_file:
+        pin_session_db(selected_db_file["id"])
+        if (
+            "local_db_path" not in st.session_state
+            or st.session_state.get("selected_db_id") != selected_db_file["id"]
+            or not os.path.exists(st.session_state["local_db_path"])
+        ):
+            # Đẩy các thay đổi chưa tải lên của database trước khi chuyển
+            if st.session_state.get("unsynced_changes") and st.session_state.get("selected_db_id") not in (
+                None, selected_db_file["id"]
+            ):
+                sync_local_db(st.session_state["selected_db_id"], st.session_state["local_db_path"], delay=0)
+            st.session_state["selected_db_id"] = selected_db_file["id"]
+            st.session_state["local_db_path"] = fetch_db_file(
+                selected_db_file["id"], progress=progress_bar("⬇️ Đang tải database")
+            )
+            st.session_state["pending_changes"] = new_change_set()
+            st.session_state["unsynced_changes"] = 0
+            st.session_state.pop("tag_index", None)
+            reset_pagers()
+            discard_export()
+            st.sidebar.success(
+                f"Đã nạp {count_quotes(st.session_state['local_db_path'])} quote từ `{selected_db_file['name']}`."
+            )
+        with perf_span("main_ui"):
+            main_ui()
     else:
-        st.sidebar.warning("⚠️ Vui lòng nhập link thư mục trước.")
-
-
-if folder_id:
-    try:
-        results = drive_service.files().list(
-            q=f"'{folder_id}' in parents and name contains '.db'",
-            fields="files(id, name)",
-            pageSize=100
-        ).execute()
-        db_files = results.get("files", [])
+        st.sidebar.info("🔑 Vui lòng nhập link thư mục Google Drive hợp lệ.")
+    with tab5:
         if db_files:
-            file_names = [f["name"] for f in db_files]
-            selected_name = st.sidebar.selectbox("🗃️ Chọn database:", file_names)
-            selected_db_file = next(f for f in db_files if f["name"] == selected_name)
+            folder_search_ui(db_files)
         else:
-            st.sidebar.warning("❗ Không tìm thấy file .db trong thư mục.")
-    except Exception as e:
-        st.sidebar.error(f"Lỗi khi truy cập Drive: {e}")
-df = st.session_state.get("quotes_df")
-st.title("📚 Quote Database Manager")
-
-tab4, tab1, tab2, tab3 = st.tabs([
-    "🎲 Random Quote",
-    "➕ Thêm Quote", 
-    "✏️ Sửa Quote", 
-    "🗑️ Xóa Quote"
-])
-
-if selected_db_file:
-    if (
-        "quotes_df" not in st.session_state
-        or st.session_state.get("selected_db_id") != selected_db_file["id"]
-    ):
-        st.session_state["selected_db_id"] = selected_db_file["id"]
-        quotes_df = load_quotes_from_drive(selected_db_file["id"])
-        st.session_state["quotes_df"] = quotes_df
-        st.sidebar.success(f"Đã nạp {len(quotes_df)} quote từ `{selected_db_file['name']}`.")
-    else:
-        quotes_df = st.session_state["quotes_df"]
-    main_ui()
-else:
-    st.sidebar.info("🔑 Vui lòng nhập link thư mục Google Drive hợp lệ.")
-if "quotes_df" in st.session_state:
-    if st.sidebar.button("🧮 Gán lại ID theo dòng (0-based index)"):
-        df = st.session_state["quotes_df"]
-        df["id"] = df.index
-        st.session_state["quotes_df"] = df
-        st.sidebar.success("✅ Đã cập nhật cột `id` thành index dòng.")
-        update_reload()
+            st.info("Chưa có database nào trong thư mục để tìm.")
+    if "local_db_path" in st.session_state:
+        if st.sidebar.button("🧮 Gán lại ID theo dòng (0-based index)"):
+            df = read_quotes(st.session_state["local_db_path"])
+            df["id"] = df.index
+            # id đổi hàng loạt nên ghi lại cả bảng thay vì theo từng dòng
+            write_full_db(st.session_state["local_db_path"], df)
+            mark_cache_dirty(selected_db_file["id"])
+            st.session_state["pending_changes"] = new_change_set()
+            st.session_state["unsynced_changes"] = st.session_state.get("unsynced_changes", 0) + len(df)
+            st.session_state.pop("tag_index", None)
+            reset_pagers()
+            st.sidebar.success("✅ Đã cập nhật cột `id` thành index dòng.")
+            update_reload()
+        if st.session_state.get("unsynced_changes"):
+            st.sidebar.warning(f"🕓 Có {st.session_state['unsynced_changes']} thay đổi chưa tải lên Drive.")
+            if st.sidebar.button("⬆️ Tải lên Drive ngay") and selected_db_file:
+                sync_local_db(selected_db_file["id"], st.session_state["local_db_path"], delay=0)
+                st.sidebar.success("✅ Đã đưa database vào hàng đợi tải lên.")
+        if selected_db_file:
+            encoding = cached_encoding(selected_db_file["id"])
+            compressed = st.sidebar.checkbox(
+                "🗜️ Lưu file này trên Drive dạng nén (gzip)", value=encoding == "gzip",
+                key=f"gzip_{selected_db_file['id']}",
+                help="Tải lên/tải về nhanh hơn khoảng 2-3 lần, nhưng chỉ app này đọc được file nén. "
+                     "Để trống nếu file còn được mở bằng công cụ SQLite khác."
+            )
+            if compressed != (encoding == "gzip"):
+                set_db_encoding(selected_db_file["id"], "gzip" if compressed else "plain")
+                sync_local_db(selected_db_file["id"], st.session_state["local_db_path"], delay=0)
+                st.sidebar.success("✅ Đã đổi cách lưu, file sẽ được tải lên lại ở nền.")
+            with st.sidebar:
+                sync_status_panel(selected_db_file["id"])
+            with st.sidebar.expander("💾 Bộ nhớ database"):
+                memory_panel(db_files)
+
+    record = perf_end_run()
+    st.sidebar.checkbox("⏱️ Hiện panel Performance", key="perf_panel")
+    if record is not None and st.session_state.get("perf_panel"):
+        with st.sidebar.expander("⏱️ Performance", expanded=True):
+            perf_panel(record)
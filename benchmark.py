@@ -0,0 +1,522 @@
+"""Benchmark các đường nóng của SQL_Card trên database quote tổng hợp và Drive giả lập.
+
+Chạy:
+    python benchmark.py --sizes 1000 10000 --out bench.json
+    python benchmark.py --sizes 1000 10000 --out new.json --compare bench.json
+
+Database được sinh theo seed cố định (nên lần chạy sau so được với lần trước) và giữ lại
+trong --work-dir để không phải sinh lại. Drive được thay bằng FakeDrive chạy trong tiến
+trình, có độ trễ mỗi request và băng thông cấu hình được.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+import SQL_Card as app
+
+
+GENERATOR_VERSION = 1
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+
+# === Sinh dữ liệu tổng hợp ===
+
+WORDS = (
+    "cuộc đời là những chuyến đi dài ai cũng phải học cách buông bỏ yêu thương người mình "
+    "không thể giữ mãi tuổi trẻ qua nhanh như một cơn gió đừng sợ thất bại vì mỗi lần vấp ngã "
+    "ta lại lớn thêm hạnh phúc đơn giản chỉ là được sống với điều mình thích nụ cười của mẹ "
+    "ngày mai trời lại sáng thời gian chữa lành mọi vết thương im lặng đôi khi là câu trả lời "
+    "tốt nhất bạn bè thật sự hiếm hoi trong đời người đi qua nhau để lại kỷ niệm đẹp nhớ "
+    "về quê hương biển xanh cánh đồng lúa chín mùa thu Hà Nội con đường nhỏ đêm mưa ly cà phê "
+    "đắng sách cũ trang giấy ước mơ bình yên lòng tin hy vọng nỗi buồn niềm vui đau khổ"
+).split()
+SPEAKERS = [
+    "Khuyết danh", "Nguyễn Nhật Ánh", "Trịnh Công Sơn", "Xuân Diệu", "Nam Cao", "Tô Hoài",
+    "Hồ Chí Minh", "Nguyễn Du", "Đặng Hoàng Giang", "Rosie Nguyễn", "Mẹ", "Bố", "Thầy giáo",
+] + [f"Người nói {i}" for i in range(200)]
+TAGS = [
+    "cuộc_sống", "tình_yêu", "gia_đình", "bạn_bè", "tuổi_trẻ", "thành_công", "thất_bại", "buồn",
+    "vui", "động_lực", "triết_lý", "hài_hước", "sách", "phim", "nhạc", "thơ", "công_việc", "học_tập",
+] + [f"chủ_đề_{i}" for i in range(100)]
+PENDING_RATE = 0.05
+NEAR_DUP_RATE = 0.03
+
+
+def _zipf_choice(rng, items, s=1.1):
+    weights = [1 / (rank + 1) ** s for rank in range(len(items))]
+    return lambda k=1: rng.choices(items, weights=weights, k=k)
+
+
+def synthetic_rows(n, seed=0):
+    """Sinh n dòng quote: câu tiếng Việt có dấu, người nói và tag phân bố Zipf, một phần gần trùng"""
+    rng = random.Random(seed)
+    word = _zipf_choice(rng, WORDS, 0.8)
+    speaker = _zipf_choice(rng, SPEAKERS)
+    tag = _zipf_choice(rng, TAGS)
+    contents = []
+    for i in range(1, n + 1):
+        if contents and rng.random() < NEAR_DUP_RATE:
+            # Chép một quote trước đó và đổi một từ
+            words = rng.choice(contents).split()
+            words[rng.randrange(len(words))] = rng.choice(WORDS)
+            content = " ".join(words)
+        else:
+            content = " ".join(word(rng.randint(6, 30))).capitalize()
+        contents.append(content)
+        tags = list(dict.fromkeys(tag(rng.choice((0, 1, 1, 2, 2, 3)))))
+        if rng.random() < PENDING_RATE:
+            tags.append("#pending")
+        date = f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(1990, 2025)}" if rng.random() < 0.5 else ""
+        link = f"https://example.com/q/{i}" if rng.random() < 0.1 else ""
+        yield (i, f'"{content}"', speaker()[0], "", date, " ".join(tags), link)
+
+
+def generate_db(path, n, seed=0):
+    """Tạo file DB cùng schema với create_empty_db_file() (bảng quotes + FTS5)"""
+    tmp = path + ".part"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    conn = sqlite3.connect(tmp)
+    try:
+        conn.execute(app.QUOTES_SCHEMA)
+        with conn:
+            conn.executemany(
+                "INSERT INTO quotes (id, content, speaker, note, date, tag, link) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                synthetic_rows(n, seed)
+            )
+        # Dựng FTS sau khi chèn xong nhanh hơn nhiều so với chạy trigger từng dòng
+        app.ensure_quotes_fts(conn)
+    finally:
+        conn.close()
+    os.replace(tmp, path)
+    return path
+
+
+def dataset_path(work_dir, n, seed):
+    path = os.path.join(work_dir, f"quotes_{n}_s{seed}_v{GENERATOR_VERSION}.db")
+    if not os.path.exists(path):
+        generate_db(path, n, seed)
+    return path
+
+
+# === Drive giả lập ===
+
+class FakeDrive:
+    """Drive trong bộ nhớ: mỗi request chờ latency giây, dữ liệu truyền theo bandwidth byte/giây.
+
+    Có thêm files().list theo thư mục và changes feed (mỗi lần ghi, đổi tên, chuyển thư mục
+    hay cho vào thùng rác thêm một thay đổi) để thử FolderListing."""
+
+    def __init__(self, latency=0.0, bandwidth=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.files = {}
+        self.requests = 0
+        self.changes = []  # fileId theo thứ tự thay đổi; page token là vị trí trong danh sách này
+        self.expired_before = 0  # token nhỏ hơn giá trị này coi như hết hạn (Drive trả 404)
+        # Lỗi cho các request media (tải về/tải lên) kế tiếp, theo thứ tự: mã HTTP, exception, hoặc None = thành công
+        self.media_faults = []
+
+    def media_fault(self):
+        """Lỗi đã hẹn cho request media này (mã HTTP hoặc exception), None nếu request thành công"""
+        fault = self.media_faults.pop(0) if self.media_faults else None
+        if isinstance(fault, BaseException):
+            raise fault
+        return fault
+
+    def wait(self, nbytes=0):
+        self.requests += 1
+        delay = self.latency + (nbytes / self.bandwidth if self.bandwidth else 0)
+        if delay:
+            time.sleep(delay)
+
+    def meta(self, file_id):
+        f = self.files[file_id]
+        return {
+            "id": file_id, "name": f["name"], "md5Checksum": f["md5"],
+            "modifiedTime": f["modified"], "size": str(len(f["data"])), "appProperties": f["appProperties"],
+        }
+
+    def put(self, file_id, name, data, app_properties=None, parents=None):
+        old = self.files.get(file_id, {})
+        self.files[file_id] = {
+            "name": name, "data": data, "md5": uuid.uuid4().hex, "modified": repr(time.time()),
+            "appProperties": app_properties or {},
+            "parents": list(parents if parents is not None else old.get("parents", [])),
+            "trashed": old.get("trashed", False),
+        }
+        self.changes.append(file_id)
+        return self.meta(file_id)
+
+    def modify(self, file_id, **fields):
+        """Đổi name/parents/trashed của file như thao tác trên giao diện Drive"""
+        self.files[file_id].update(fields)
+        self.changes.append(file_id)
+
+    def delete(self, file_id):
+        del self.files[file_id]
+        self.changes.append(file_id)
+
+    def list_folder(self, q, page_size, page_token):
+        folder_id = re.search(r"'([^']+)' in parents", q).group(1)
+        matched = sorted(
+            file_id for file_id, f in self.files.items()
+            if folder_id in f["parents"] and ".db" in f["name"] and not f["trashed"]
+        )
+        start = int(page_token or 0)
+        page = matched[start:start + page_size]
+        result = {"files": [{"id": file_id, "name": self.files[file_id]["name"]} for file_id in page]}
+        if start + page_size < len(matched):
+            result["nextPageToken"] = str(start + page_size)
+        return result
+
+    def list_changes(self, page_token, page_size):
+        start = int(page_token)
+        if start < self.expired_before or start > len(self.changes):
+            raise HttpError(httplib2.Response({"status": 404}), b"Invalid page token")
+        changes = []
+        for file_id in self.changes[start:start + page_size]:
+            f = self.files.get(file_id)
+            if f is None:
+                changes.append({"fileId": file_id, "removed": True})
+            else:
+                changes.append({
+                    "fileId": file_id, "removed": False,
+                    "file": {"id": file_id, "name": f["name"], "parents": f["parents"], "trashed": f["trashed"]},
+                })
+        result = {"changes": changes}
+        if start + page_size < len(self.changes):
+            result["nextPageToken"] = str(start + page_size)
+        else:
+            result["newStartPageToken"] = str(len(self.changes))
+        return result
+
+
+class _Call:
+    def __init__(self, drive, fn):
+        self.drive, self.fn = drive, fn
+
+    def execute(self):
+        self.drive.wait()
+        return self.fn()
+
+
+class _MediaHttp:
+    """Phía http mà MediaIoBaseDownload dùng: trả từng khoảng byte theo header Range"""
+
+    def __init__(self, drive, file_id):
+        self.drive, self.file_id = drive, file_id
+
+    def request(self, uri, method="GET", headers=None, **kwargs):
+        status = self.drive.media_fault()
+        if status:
+            return httplib2.Response({"status": status}), b"{}"
+        data = self.drive.files[self.file_id]["data"]
+        start, end = (int(x) for x in headers["range"].split("=")[1].split("-"))
+        chunk = data[start:end + 1]
+        self.drive.wait(len(chunk))
+        resp = httplib2.Response({"status": 206, "content-range": f"bytes {start}-{start + len(chunk) - 1}/{len(data)}"})
+        return resp, chunk
+
+
+class _MediaRequest:
+    def __init__(self, drive, file_id):
+        self.uri = f"fake://{file_id}"
+        self.headers = {}
+        self.http = _MediaHttp(drive, file_id)
+
+
+class _Progress:
+    def __init__(self, done, total):
+        self.resumable_progress, self.total_size = done, total
+
+
+class _ResumableUpload:
+    """Upload resumable giả: đọc media theo chunk như googleapiclient rồi ghi vào FakeDrive"""
+
+    def __init__(self, drive, media, finish):
+        self.drive, self.media, self.finish = drive, media, finish
+        self.buffer = bytearray()
+
+    def next_chunk(self, num_retries=0):
+        status = self.drive.media_fault()
+        if status:
+            raise HttpError(httplib2.Response({"status": status}), b"{}")
+        size = self.media.size()
+        chunk = self.media.getbytes(len(self.buffer), self.media.chunksize())
+        self.drive.wait(len(chunk))
+        self.buffer += chunk
+        if len(self.buffer) >= size:
+            return None, self.finish(bytes(self.buffer))
+        return _Progress(len(self.buffer), size), None
+
+
+class _FakeFiles:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def get(self, fileId, fields=None, **kwargs):
+        return _Call(self.drive, lambda: self.drive.meta(fileId))
+
+    def get_media(self, fileId, **kwargs):
+        return _MediaRequest(self.drive, fileId)
+
+    def update(self, fileId, body=None, media_body=None, fields=None, **kwargs):
+        old = self.drive.files[fileId]
+        name = (body or {}).get("name") or old["name"]
+        props = {**old["appProperties"], **((body or {}).get("appProperties") or {})}
+        return _ResumableUpload(self.drive, media_body, lambda data: self.drive.put(fileId, name, data, props))
+
+    def create(self, body=None, media_body=None, fields=None, **kwargs):
+        file_id = uuid.uuid4().hex[:12]
+        return _ResumableUpload(
+            self.drive, media_body, lambda data: self.drive.put(file_id, body["name"], data, parents=body.get("parents"))
+        )
+
+    def list(self, q=None, fields=None, pageSize=100, pageToken=None, **kwargs):
+        return _Call(self.drive, lambda: self.drive.list_folder(q, pageSize, pageToken))
+
+
+class _FakeChanges:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def getStartPageToken(self, **kwargs):
+        return _Call(self.drive, lambda: {"startPageToken": str(len(self.drive.changes))})
+
+    def list(self, pageToken=None, fields=None, pageSize=100, **kwargs):
+        return _Call(self.drive, lambda: self.drive.list_changes(pageToken, pageSize))
+
+
+class FakeService:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def files(self):
+        return _FakeFiles(self.drive)
+
+    def changes(self):
+        return _FakeChanges(self.drive)
+
+
+class FakePool:
+    """Thay DrivePool của app: mọi client đều là FakeService trên cùng FakeDrive"""
+
+    def __init__(self, drive):
+        self.service = FakeService(drive)
+
+    def client(self):
+        return _Lease(self.service)
+
+
+class _Lease:
+    def __init__(self, service):
+        self.service = service
+
+    def __enter__(self):
+        return self.service
+
+    def __exit__(self, *exc):
+        return False
+
+
+def install_fake_drive(drive, cache_dir):
+    app.get_drive_pool = lambda: FakePool(drive)
+    app.CACHE_DIR = cache_dir
+
+
+# === Các phép đo ===
+
+def timed(fn, repeat, setup=None):
+    runs = []
+    for _ in range(repeat):
+        state = setup() if setup else None
+        start = time.perf_counter()
+        fn(state) if setup else fn()
+        runs.append(time.perf_counter() - start)
+    return {"median": statistics.median(runs), "min": min(runs), "runs": runs}
+
+
+def bench_size(n, args, drive):
+    source = dataset_path(args.work_dir, n, args.seed)
+    file_id = f"bench{n}"
+    with open(source, "rb") as fh:
+        drive.put(file_id, os.path.basename(source), fh.read())
+    results = {}
+    repeat = args.repeat
+
+    def cold_download():
+        app.drop_cache_entry(file_id)
+
+    results["download_cold"] = timed(lambda _: app.fetch_db_file(file_id), repeat, setup=cold_download)
+    results["download_warm"] = timed(lambda: app.fetch_db_file(file_id), repeat)
+    db_path = app.fetch_db_file(file_id)
+
+    rng = random.Random(args.seed)
+    ids = app.fetch_all_ids(db_path)
+
+    def save_and_upload():
+        quote_id = rng.choice(ids)
+        row = app.fetch_quote(db_path, quote_id)
+        row["note"] = f"sửa lúc {time.time()}"
+        changes = app.new_change_set()
+        changes["update"][quote_id] = row
+        app.apply_changes(db_path, changes)
+        snapshot = app.snapshot_db(db_path)
+        try:
+            app.upload_db_file(snapshot, file_id, fields=app.REMOTE_META_FIELDS, encoding=args.encoding)
+        finally:
+            os.remove(snapshot)
+
+    results["save_upload"] = timed(save_and_upload, repeat)
+    # Sau save_upload, file trên Drive có dạng --encoding (gzip thì không còn là file thô)
+    results["download_cold_saved"] = timed(lambda _: app.fetch_db_file(file_id), repeat, setup=cold_download)
+
+    def drop_store():
+        app.quote_store_registry()["stores"].pop(db_path, None)
+
+    results["tag_store_build"] = timed(lambda _: app.get_quote_store(db_path), repeat, setup=drop_store)
+    index = app.TagIndex(app.get_quote_store(db_path))
+    included, excluded = ["cuộc_sống", "tình_yêu"], ["#pending"]
+    results["tag_filter"] = timed(lambda: index.filter(included, excluded), repeat)
+
+    def sample_1000():
+        sampler = app.QuoteSampler(index, included, excluded, {"#pending": app.PENDING_WEIGHT})
+        for _ in range(1000):
+            app.fetch_quote(db_path, sampler.draw())
+
+    results["sample_1000"] = timed(sample_1000, repeat)
+
+    queries = ["cuoc doi", "hạnh phúc", "ca phe", "nụ cười của mẹ"]
+    results["search"] = timed(lambda: [app.search_quote_ids(db_path, q) for q in queries], repeat)
+    results["page_10"] = timed(lambda: _scan_pages(db_path, 10), repeat)
+
+    if n <= args.near_dup_max:
+        def fresh_near_dup():
+            if os.path.exists(app.near_dup_path(db_path)):
+                os.remove(app.near_dup_path(db_path))
+
+        results["near_dup_build"] = timed(lambda _: app.NearDuplicateIndex(db_path).refresh(), repeat, setup=fresh_near_dup)
+        near_dup = app.NearDuplicateIndex(db_path).refresh()
+        results["near_dup_clusters"] = timed(lambda: (near_dup._clusters.clear(), near_dup.clusters()), repeat)
+
+    copy_ids = rng.sample(ids, min(1000, len(ids)))
+
+    def empty_target():
+        path = os.path.join(args.cache_dir, f"target_{uuid.uuid4().hex}.db")
+        conn = sqlite3.connect(path)
+        app.ensure_quotes_schema(conn)
+        conn.close()
+        return path
+
+    results["copy_1000"] = timed(lambda target: app.copy_quotes_between(db_path, target, copy_ids), repeat, setup=empty_target)
+
+    export_path = os.path.join(args.cache_dir, f"export_{n}.jsonl")
+
+    def export_jsonl():
+        with open(export_path, "w", encoding="utf-8", newline="") as fh:
+            app.export_quotes(db_path, fh, "jsonl")
+
+    def import_jsonl(target):
+        with open(export_path, encoding="utf-8") as fh:
+            app.import_quotes(target, app.read_import_rows(fh, "jsonl"))
+
+    results["export_jsonl"] = timed(export_jsonl, repeat)
+    results["import_jsonl"] = timed(import_jsonl, repeat, setup=empty_target)
+    return results
+
+
+def _scan_pages(db_path, pages):
+    after = None
+    for _ in range(pages):
+        rows = app.fetch_page(db_path, after)
+        if not rows:
+            break
+        after = rows[-1]["id"]
+
+
+# === So sánh với lần chạy trước ===
+
+def compare(current, previous, threshold):
+    """In tỉ lệ median mới/cũ; trả về danh sách phép đo chậm hơn ngưỡng"""
+    regressions = []
+    for size, cases in current["results"].items():
+        for case, stats in cases.items():
+            old = previous.get("results", {}).get(size, {}).get(case)
+            if not old or not old["median"]:
+                continue
+            ratio = stats["median"] / old["median"]
+            flag = "  <-- chậm hơn" if ratio > threshold else ""
+            print(f"{size:>8} {case:<20} {old['median'] * 1000:10.2f} ms -> {stats['median'] * 1000:10.2f} ms  x{ratio:.2f}{flag}")
+            if ratio > threshold:
+                regressions.append((size, case, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="độ trễ mỗi request tới Drive giả")
+    parser.add_argument("--bandwidth-mbps", type=float, default=100.0, help="băng thông Drive giả (Mbit/s, 0 = không giới hạn)")
+    parser.add_argument("--encoding", choices=["plain", "gzip"], default="plain", help="cách lưu file ở phép đo save_upload")
+    parser.add_argument("--near-dup-max", type=int, default=1000000, help="bỏ qua phép đo gần trùng với DB lớn hơn")
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "quote_bench"))
+    parser.add_argument("--out", default="bench.json")
+    parser.add_argument("--compare", help="file JSON của lần chạy trước để so sánh")
+    parser.add_argument("--threshold", type=float, default=1.2, help="tỉ lệ chậm hơn bị coi là hồi quy")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    args.cache_dir = tempfile.mkdtemp(prefix="cache_", dir=args.work_dir)
+    drive = FakeDrive(args.latency_ms / 1000, args.bandwidth_mbps * 125000 or None)
+    install_fake_drive(drive, args.cache_dir)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "generator_version": GENERATOR_VERSION,
+            "args": {k: v for k, v in vars(args).items() if k not in ("work_dir", "cache_dir", "out", "compare")},
+        },
+        "results": {},
+    }
+    try:
+        for n in args.sizes:
+            print(f"== {n} dòng")
+            results = report["results"][str(n)] = bench_size(n, args, drive)
+            for case, stats in results.items():
+                print(f"  {case:<20} {stats['median'] * 1000:10.2f} ms")
+    finally:
+        app.get_upload_queue().shutdown()
+        shutil.rmtree(args.cache_dir, ignore_errors=True)
+
+    with open(args.out, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, ensure_ascii=False, indent=2)
+    print(f"Đã ghi kết quả vào {args.out}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            regressions = compare(report, json.load(fh), args.threshold)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
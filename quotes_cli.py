@@ -0,0 +1,105 @@
+"""Nhập/xuất quote hàng loạt (CSV, JSONL) không cần mở giao diện Streamlit.
+
+Chạy:
+    python quotes_cli.py import --db quote.db quotes.csv
+    python quotes_cli.py export --db quote.db quotes.jsonl
+    python quotes_cli.py import --file-id <id file trên Drive> quotes.jsonl
+
+Định dạng lấy theo đuôi file (.csv, .jsonl, .ndjson) hoặc --format; "-" là stdin/stdout.
+Với --file-id, database được tải về cache dùng chung với app (cần .streamlit/secrets.toml),
+nhập xong thì tải lên Drive đúng một lần.
+"""
+import argparse
+import csv
+import os
+import sqlite3
+import sys
+
+import SQL_Card as app
+
+
+def resolve_format(path, fmt):
+    fmt = fmt or (None if path == "-" else app.import_format(path))
+    if fmt is None:
+        sys.exit(f"Không đoán được định dạng của {path!r}, hãy dùng --format csv|jsonl")
+    return fmt
+
+
+def open_text(path, mode):
+    if path == "-":
+        stream = sys.stdin if mode == "r" else sys.stdout
+        stream.reconfigure(encoding="utf-8", newline="")
+        return stream
+    return open(path, mode, encoding="utf-8-sig" if mode == "r" else "utf-8", newline="")
+
+
+def upload_back(file_id, db_path):
+    """Tải lên qua hàng đợi của app (chụp bản, thử lại, ghi meta cache) và chờ xong"""
+    queue = app.get_upload_queue()
+    queue.submit(file_id, db_path, delay=0)
+    queue.flush()
+    error = queue.status_of(file_id).get("error")
+    if error:
+        sys.exit(f"Lỗi tải database lên Drive: {error}")
+
+
+def cmd_import(args, db_path):
+    fmt = resolve_format(args.path, args.format)
+    with open_text(args.path, "r") as fh:
+        stats = app.import_quotes(
+            db_path, app.read_import_rows(fh, fmt), dedupe=not args.keep_duplicates, chunk_size=args.chunk_rows
+        )
+    print(
+        f"Đã thêm {stats['inserted']} quote, bỏ qua {stats['duplicates']} quote trùng và {stats['empty']} dòng rỗng.",
+        file=sys.stderr
+    )
+    if args.file_id and stats["inserted"]:
+        app.mark_cache_dirty(args.file_id)
+        upload_back(args.file_id, db_path)
+        print("Đã tải database lên Drive.", file=sys.stderr)
+
+
+def cmd_export(args, db_path):
+    fmt = resolve_format(args.path, args.format)
+    with open_text(args.path, "w") as fh:
+        count = app.export_quotes(db_path, fh, fmt, chunk_size=args.chunk_rows)
+    print(f"Đã xuất {count} quote.", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name, handler in (("import", cmd_import), ("export", cmd_export)):
+        cmd = sub.add_parser(name)
+        target = cmd.add_mutually_exclusive_group(required=True)
+        target.add_argument("--db", help="file SQLite cục bộ")
+        target.add_argument("--file-id", help="id file database trên Google Drive")
+        cmd.add_argument("path", help="file CSV/JSONL, hoặc - cho stdin/stdout")
+        cmd.add_argument("--format", choices=["csv", "jsonl"])
+        cmd.add_argument("--chunk-rows", type=int, default=app.IMPORT_CHUNK_ROWS)
+        if name == "import":
+            cmd.add_argument("--keep-duplicates", action="store_true", help="không bỏ qua quote trùng nội dung")
+        cmd.set_defaults(handler=handler)
+    args = parser.parse_args(argv)
+
+    if args.file_id:
+        db_path = app.fetch_db_file(args.file_id)
+    else:
+        if args.command == "export" and not os.path.exists(args.db):
+            sys.exit(f"Không tìm thấy database {args.db!r}")
+        db_path = args.db
+        conn = sqlite3.connect(db_path)
+        try:
+            app.ensure_quotes_schema(conn)
+        finally:
+            conn.close()
+    try:
+        args.handler(args, db_path)
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        sys.exit(f"Lỗi: {e}")
+    finally:
+        app.get_upload_queue().shutdown()
+
+
+if __name__ == "__main__":
+    main()
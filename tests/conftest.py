@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark  # noqa: E402
+import SQL_Card as app  # noqa: E402
+
+
+@pytest.fixture
+def drive(tmp_path, monkeypatch):
+    """FakeDrive của benchmark.py thay cho Drive thật, cache database nằm trong tmp_path"""
+    fake = benchmark.FakeDrive()
+    monkeypatch.setattr(app, "get_drive_pool", lambda: benchmark.FakePool(fake))
+    monkeypatch.setattr(app, "CACHE_DIR", str(tmp_path / "cache"))
+    os.makedirs(app.CACHE_DIR)
+    return fake
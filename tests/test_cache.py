@@ -0,0 +1,74 @@
+import os
+import sqlite3
+
+import SQL_Card as app
+
+
+def make_entry(file_id, rows=100):
+    db_path, _ = app.cache_paths(file_id)
+    conn = sqlite3.connect(db_path)
+    app.ensure_quotes_schema(conn)
+    with conn:
+        conn.executemany("INSERT INTO quotes (content) VALUES (?)", [(f'"q {i}"',) for i in range(rows)])
+    conn.close()
+    app.write_cache_meta(file_id, {"md5Checksum": file_id})
+    return db_path
+
+
+def test_eviction_skips_snapshots_and_files_without_meta(drive, monkeypatch):
+    monkeypatch.setattr(app, "CACHE_MAX_BYTES", 0)
+    db_path = make_entry("a")
+    snapshot_path = app.snapshot_db(db_path)
+    stray = os.path.join(app.CACHE_DIR, "stray.db")
+    with open(stray, "wb") as f:
+        f.write(b"x" * 4096)
+
+    app.evict_cache()
+
+    assert not os.path.exists(db_path)
+    assert os.path.exists(snapshot_path) and os.path.exists(stray)
+
+
+def test_eviction_keeps_dirty_and_kept_entries(drive, monkeypatch):
+    monkeypatch.setattr(app, "CACHE_MAX_BYTES", 0)
+    kept, dirty, old = make_entry("kept"), make_entry("dirty"), make_entry("old")
+    app.mark_cache_dirty("dirty")
+
+    app.evict_cache(keep="kept")
+
+    assert os.path.exists(kept) and os.path.exists(dirty) and not os.path.exists(old)
+
+
+def test_eviction_counts_near_dup_sidecar(drive, monkeypatch):
+    old, new = make_entry("old"), make_entry("new")
+    with open(app.near_dup_path(new), "wb") as f:
+        f.write(b"x" * 200000)
+    # Chỉ riêng các file .db thì vừa đủ; thêm file chữ ký thì vượt giới hạn
+    monkeypatch.setattr(app, "CACHE_MAX_BYTES", os.path.getsize(old) + os.path.getsize(new))
+    os.utime(old, (1, 1))
+
+    app.evict_cache(keep="new")
+
+    assert not os.path.exists(old) and os.path.exists(new)
+
+
+def test_drop_releases_in_memory_near_dup_index(drive):
+    db_path = make_entry("a")
+    index = app.get_near_dup_index(db_path)
+    assert app.get_near_dup_index(db_path) is index
+
+    app.drop_cache_entry("a")
+
+    assert app.get_near_dup_index(db_path) is not index
+    assert not os.path.exists(app.near_dup_path(db_path))
+
+
+def test_drop_releases_shared_quote_store(drive, monkeypatch):
+    db_path = make_entry("a")
+    app.get_quote_store(db_path)
+    assert db_path in app.quote_store_registry()["stores"]
+
+    monkeypatch.setattr(app, "CACHE_MAX_BYTES", 0)
+    app.evict_cache()
+
+    assert db_path not in app.quote_store_registry()["stores"]
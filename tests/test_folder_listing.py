@@ -0,0 +1,88 @@
+import pytest
+
+import SQL_Card as app
+
+FOLDER = "folder"
+
+
+@pytest.fixture
+def listing(drive, monkeypatch):
+    # Mỗi lần gọi files() đều đọc changes feed, không chờ FOLDER_POLL_SECONDS
+    monkeypatch.setattr(app, "FOLDER_POLL_SECONDS", 0)
+    return app.FolderListing(FOLDER)
+
+
+def names(files):
+    return [f["name"] for f in files]
+
+
+def add(drive, file_id, name, parents=(FOLDER,)):
+    drive.put(file_id, name, b"", parents=parents)
+
+
+def test_relist_follows_next_page_token(drive, listing, monkeypatch):
+    monkeypatch.setattr(app, "FOLDER_PAGE_SIZE", 3)
+    for i in range(8):
+        add(drive, f"f{i}", f"quote_{i}.db")
+    add(drive, "txt", "notes.txt")
+    add(drive, "other", "other.db", parents=("another",))
+
+    assert names(listing.files()) == [f"quote_{i}.db" for i in range(8)]
+    # 8 file, 3 file mỗi trang: startPageToken + 3 trang list
+    assert drive.requests == 4
+
+
+def test_changes_feed_applies_rename_move_and_trash(drive, listing):
+    for file_id in ("a", "b", "c", "d"):
+        add(drive, file_id, f"{file_id}.db")
+    listing.files()
+
+    drive.modify("a", name="renamed.db")
+    drive.modify("b", parents=["another"])
+    drive.modify("c", trashed=True)
+    drive.delete("d")
+    add(drive, "e", "new.db")
+    add(drive, "f", "elsewhere.db", parents=("another",))
+
+    assert names(listing.files()) == ["new.db", "renamed.db"]
+
+
+def test_rename_to_non_db_name_drops_file(drive, listing):
+    add(drive, "a", "a.db")
+    listing.files()
+    drive.modify("a", name="a.bak")
+    assert listing.files() == []
+
+
+def test_changes_feed_follows_next_page_token(drive, listing, monkeypatch):
+    listing.files()
+    monkeypatch.setattr(app, "FOLDER_PAGE_SIZE", 2)
+    for i in range(5):
+        add(drive, f"f{i}", f"quote_{i}.db")
+    assert names(listing.files()) == [f"quote_{i}.db" for i in range(5)]
+    # Token mới đã trỏ qua hết các thay đổi: lần đọc sau không áp lại gì
+    drive.modify("f0", name="zz.db")
+    assert names(listing.files())[-1] == "zz.db"
+
+
+def test_expired_change_token_falls_back_to_full_relist(drive, listing):
+    add(drive, "a", "a.db")
+    listing.files()
+    add(drive, "b", "b.db")
+    drive.expired_before = len(drive.changes)
+
+    assert names(listing.files()) == ["a.db", "b.db"]
+    # Sau khi liệt kê lại, token mới dùng được cho lần đọc thay đổi tiếp theo
+    add(drive, "c", "c.db")
+    assert names(listing.files()) == ["a.db", "b.db", "c.db"]
+
+
+def test_no_drive_request_between_polls(drive, listing, monkeypatch):
+    add(drive, "a", "a.db")
+    listing.files()
+    monkeypatch.setattr(app, "FOLDER_POLL_SECONDS", 60)
+    before = drive.requests
+    add(drive, "b", "b.db")
+    assert names(listing.files()) == ["a.db"]
+    assert drive.requests == before
+    assert names(listing.files(force=True)) == ["a.db", "b.db"]
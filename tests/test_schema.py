@@ -0,0 +1,38 @@
+import os
+import shutil
+import sqlite3
+
+import SQL_Card as app
+
+REPO_DB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "quote.db")
+
+
+def columns(conn):
+    return [row[1] for row in conn.execute("PRAGMA table_info(quotes)")]
+
+
+def test_missing_columns_are_added(tmp_path):
+    # quote.db của repo có id INTEGER PRIMARY KEY nhưng chưa có cột link
+    path = str(tmp_path / "quote.db")
+    shutil.copy(REPO_DB, path)
+    conn = sqlite3.connect(path)
+    count = conn.execute("SELECT COUNT(*) FROM quotes").fetchone()[0]
+    app.ensure_quotes_schema(conn)
+    assert columns(conn) == app.QUOTE_COLUMNS
+    assert conn.execute("SELECT COUNT(*) FROM quotes").fetchone()[0] == count
+    conn.close()
+
+    first = app.fetch_page(path, limit=1, columns=app.QUOTE_COLUMNS)[0]
+    assert app.fetch_quote(path, first["id"])["link"] is None
+
+
+def test_table_without_primary_key_is_rebuilt(tmp_path):
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE quotes (id INTEGER, content TEXT, tag TEXT)")
+    conn.executemany("INSERT INTO quotes VALUES (?, ?, ?)", [(1, "a", "x"), (1, "b", "y"), (None, "c", "")])
+    conn.commit()
+    app.ensure_quotes_schema(conn)
+    assert columns(conn) == app.QUOTE_COLUMNS
+    assert conn.execute("SELECT id, content FROM quotes ORDER BY id").fetchall() == [(1, "a"), (2, "b"), (3, "c")]
+    conn.close()
@@ -0,0 +1,67 @@
+import sqlite3
+
+import pytest
+
+import SQL_Card as app
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "quotes.db")
+    conn = sqlite3.connect(path)
+    app.ensure_quotes_schema(conn)
+    with conn:
+        conn.executemany(
+            "INSERT INTO quotes (id, content, speaker, tag) VALUES (?, ?, 'S', 'x')",
+            [(i, f'"q {i}"') for i in range(1, 11)]
+        )
+    conn.close()
+    return path
+
+
+def save(db_path, index, changes):
+    """Như update_reload: ghi bộ thay đổi rồi đổi id tạm trong chỉ mục sang id thật"""
+    applied, new_ids, missing = app.apply_changes(db_path, changes)
+    for temp_id, quote_id in new_ids.items():
+        index.rekey(temp_id, quote_id)
+    return new_ids
+
+
+def test_adding_after_deleting_newest_quote_keeps_it_deleted(db_path):
+    index = app.TagIndex(app.get_quote_store(db_path))
+    index.vocabulary("tag")
+
+    index.delete([10])
+    save(db_path, index, {"insert": {}, "update": {}, "delete": {10}})
+
+    temp_id = app.temp_quote_id()
+    row = {"id": temp_id, "content": '"mới"', "speaker": "S", "tag": "y"}
+    index.add(row)
+    new_ids = save(db_path, index, {"insert": {temp_id: row}, "update": {}, "delete": set()})
+
+    assert new_ids == {temp_id: 11}
+    assert index.size == app.count_quotes(db_path) == 10
+    ids = index.filter([], []).tolist()
+    assert 10 not in ids and 11 in ids and len(ids) == 10
+    assert index.vocabulary("tag").counts == {"x": 9, "y": 1}
+
+
+def test_temp_ids_never_match_real_ids():
+    first, second = app.temp_quote_id(), app.temp_quote_id()
+    assert first < 0 and second < 0 and first != second
+
+
+def test_update_of_row_removed_elsewhere_is_reported(db_path):
+    row = app.fetch_quote(db_path, 3)
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute("DELETE FROM quotes WHERE id = 3")  # phiên khác vừa Move quote 3 đi
+    conn.close()
+
+    changes = {"insert": {}, "update": {3: {**row, "note": "sửa"}, 4: {**app.fetch_quote(db_path, 4), "note": "sửa"}},
+               "delete": set()}
+    applied, new_ids, missing = app.apply_changes(db_path, changes)
+
+    assert (applied, missing) == (1, {3})
+    assert app.fetch_quote(db_path, 3) is None
+    assert app.fetch_quote(db_path, 4)["note"] == "sửa"
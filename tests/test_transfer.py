@@ -0,0 +1,124 @@
+import gzip
+import io
+import os
+
+import pytest
+from googleapiclient.errors import HttpError
+
+import SQL_Card as app
+
+CHUNK = 256 * 1024
+DATA = os.urandom(CHUNK * 2 + 1000)  # 3 chunk, chunk cuối thiếu
+
+
+@pytest.fixture
+def sleeps(drive, monkeypatch):
+    """Chunk nhỏ để một file cần nhiều request; ghi lại các lần chờ backoff thay vì chờ thật"""
+    monkeypatch.setattr(app, "TRANSFER_CHUNK_BYTES", CHUNK)
+    waits = []
+    monkeypatch.setattr(app.time, "sleep", waits.append)
+    return waits
+
+
+def download(file_id):
+    fh = io.BytesIO()
+    app.download_db_file(file_id, fh)
+    return fh.getvalue()
+
+
+def test_download_resumes_after_transient_errors(drive, sleeps):
+    drive.put("f", "f.db", DATA)
+    drive.media_faults = [None, 503, OSError("connection reset"), None, 429]
+
+    assert download("f") == DATA
+    assert len(sleeps) == 3
+    # Chạy tiếp từ chunk đang dở: mỗi chunk chỉ tải thành công đúng một lần
+    assert drive.requests == 3 and drive.media_faults == []
+
+
+def test_upload_resumes_after_transient_errors(drive, sleeps, tmp_path):
+    drive.put("f", "f.db", b"")
+    path = tmp_path / "up.db"
+    path.write_bytes(DATA)
+    drive.media_faults = [None, 500, OSError("broken pipe"), None]
+
+    app.upload_db_file(str(path), "f", encoding="plain")
+
+    assert drive.files["f"]["data"] == DATA
+    assert len(sleeps) == 2
+
+
+@pytest.mark.parametrize("status", [403, 404])
+def test_non_retryable_error_is_raised_at_once(drive, sleeps, tmp_path, status):
+    drive.put("f", "f.db", DATA)
+    drive.media_faults = [status]
+    with pytest.raises(HttpError):
+        download("f")
+
+    path = tmp_path / "up.db"
+    path.write_bytes(DATA)
+    drive.media_faults = [status]
+    with pytest.raises(HttpError):
+        app.upload_db_file(str(path), "f", encoding="plain")
+    assert sleeps == []
+
+
+def test_gives_up_after_max_retries(drive, sleeps, monkeypatch):
+    monkeypatch.setattr(app, "TRANSFER_MAX_RETRIES", 2)
+    drive.put("f", "f.db", DATA)
+    drive.media_faults = [503] * 5
+    with pytest.raises(HttpError):
+        download("f")
+    assert len(sleeps) == 2
+
+
+def test_progress_reports_every_chunk(drive, sleeps):
+    drive.put("f", "f.db", DATA)
+    seen = []
+    app.download_db_file("f", io.BytesIO(), progress=lambda done, total: seen.append((done, total)))
+    assert seen == [(CHUNK, len(DATA)), (2 * CHUNK, len(DATA)), (len(DATA), len(DATA))]
+
+
+def write_in_pieces(data, sizes):
+    fh = io.BytesIO()
+    writer = app.DecodingWriter(fh)
+    pos = 0
+    for size in sizes:
+        writer.write(data[pos:pos + size])
+        pos += size
+    writer.write(data[pos:])
+    writer.finish()
+    return writer, fh.getvalue()
+
+
+def test_gzip_is_detected_across_chunk_boundaries():
+    # Byte đầu tiên đến riêng: magic gzip chỉ đủ ở lần ghi thứ hai
+    writer, out = write_in_pieces(gzip.compress(DATA), [1, 1, 5000])
+    assert writer.encoding == "gzip" and out == DATA
+
+    writer, out = write_in_pieces(DATA, [1, 7])
+    assert writer.encoding == "plain" and out == DATA
+
+
+def test_short_plain_file_is_kept():
+    writer, out = write_in_pieces(b"x", [])
+    assert writer.encoding == "plain" and out == b"x"
+
+
+def test_gzip_download_is_inflated(drive, sleeps):
+    drive.put("f", "f.db", gzip.compress(DATA), {"dbEncoding": "gzip"})
+    assert download("f") == DATA
+
+
+def test_truncated_gzip_fails():
+    packed = gzip.compress(DATA)
+    with pytest.raises(ValueError):
+        write_in_pieces(packed[:len(packed) // 2], [])
+
+
+def test_truncated_gzip_download_leaves_no_cache_file(drive, sleeps):
+    packed = gzip.compress(DATA)
+    drive.put("f", "f.db", packed[:-100], {"dbEncoding": "gzip"})
+    with pytest.raises(ValueError):
+        app.fetch_db_file("f")
+    assert os.listdir(app.CACHE_DIR) == []
@@ -0,0 +1,156 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import SQL_Card as app
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "quotes.db")
+    conn = sqlite3.connect(path)
+    app.ensure_quotes_schema(conn)
+    conn.close()
+    return path
+
+
+def add_quote(db_path):
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute("INSERT INTO quotes (content) VALUES ('\"q\"')")
+    conn.close()
+
+
+def row_count(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM quotes").fetchone()[0]
+    finally:
+        conn.close()
+
+
+class Uploads:
+    """Hàm upload giả: ghi lại (file_id, số dòng trong snapshot), lỗi theo danh sách fail"""
+
+    def __init__(self, fail=()):
+        self.calls = []
+        self.fail = list(fail)
+        self.gate = None
+        self.entered = threading.Event()
+
+    def __call__(self, file_id, path):
+        self.entered.set()
+        if self.gate:
+            self.gate.wait(5)
+        self.calls.append((file_id, row_count(path)))
+        if self.fail and self.fail.pop(0):
+            raise OSError("mất kết nối")
+        return {"id": file_id}
+
+
+@pytest.fixture
+def make_queue():
+    queues = []
+
+    def make(upload, delay=0.2):
+        queue = app.UploadQueue(upload, delay=delay)
+        queues.append(queue)
+        return queue
+
+    yield make
+    for queue in queues:
+        queue.shutdown()
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "hết thời gian chờ"
+        time.sleep(0.01)
+
+
+def test_consecutive_saves_coalesce_into_one_upload(db_path, make_queue):
+    uploads = Uploads()
+    queue = make_queue(uploads, delay=0.3)
+    for _ in range(3):
+        add_quote(db_path)
+        queue.submit("f", db_path)
+    assert queue.status_of("f")["pending"] == 3
+
+    assert queue.flush(timeout=5)
+    assert uploads.calls == [("f", 3)]
+    status = queue.status_of("f")
+    assert status["pending"] == 0 and status["error"] is None and status["last_success"]
+
+
+def test_upload_waits_for_coalesce_delay(db_path, make_queue):
+    uploads = Uploads()
+    queue = make_queue(uploads, delay=0.3)
+    queue.submit("f", db_path)
+    time.sleep(0.1)
+    assert uploads.calls == [] and queue.has_pending("f")
+    wait_until(lambda: not queue.has_pending("f"))
+    assert uploads.calls == [("f", 0)]
+
+
+def test_each_file_gets_its_own_upload(db_path, tmp_path, make_queue):
+    other = str(tmp_path / "other.db")
+    conn = sqlite3.connect(other)
+    app.ensure_quotes_schema(conn)
+    conn.close()
+    add_quote(other)
+    uploads = Uploads()
+    queue = make_queue(uploads)
+    queue.submit("a", db_path)
+    queue.submit("b", other)
+    queue.submit("a", db_path)
+
+    assert queue.flush(timeout=5)
+    assert sorted(uploads.calls) == [("a", 0), ("b", 1)]
+
+
+def test_failed_upload_is_retried(db_path, make_queue):
+    uploads = Uploads(fail=[True])
+    queue = make_queue(uploads)
+    queue.submit("f", db_path, delay=0)
+    wait_until(lambda: queue.status_of("f").get("error"))
+    status = queue.status_of("f")
+    assert "lần thử 1" in status["error"] and status["pending"] == 1
+
+    assert queue.flush(timeout=5)
+    assert uploads.calls == [("f", 0), ("f", 0)]
+    assert queue.status_of("f")["error"] is None
+
+
+def test_gives_up_after_max_attempts(db_path, make_queue, monkeypatch):
+    monkeypatch.setattr(app, "UPLOAD_MAX_ATTEMPTS", 2)
+    uploads = Uploads(fail=[True] * 5)
+    queue = make_queue(uploads)
+    queue.submit("f", db_path, delay=0)
+    # Lần thử lại được hẹn sau backoff; mỗi flush() cho chạy ngay lần đang chờ
+    for _ in range(3):
+        if queue.flush(timeout=0.5):
+            break
+    assert len(uploads.calls) == 2
+    assert not queue.has_pending("f")
+    assert "lần thử 2" in queue.status_of("f")["error"]
+
+
+def test_newer_save_replaces_retry_of_failed_upload(db_path, make_queue):
+    uploads = Uploads(fail=[True])
+    uploads.gate = threading.Event()
+    queue = make_queue(uploads)
+    queue.submit("f", db_path, delay=0)
+    assert uploads.entered.wait(5)
+
+    # Lưu thêm trong lúc upload đầu đang chạy (và sẽ lỗi)
+    add_quote(db_path)
+    queue.submit("f", db_path, delay=0)
+    uploads.gate.set()
+
+    assert queue.flush(timeout=5)
+    # Không thử lại bản cũ: chỉ còn lần tải bản mới hơn
+    assert uploads.calls == [("f", 0), ("f", 1)]
+    assert queue.status_of("f")["error"] is None